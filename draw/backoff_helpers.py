@@ -0,0 +1,13 @@
+import random
+
+FIRST_DELAY = 3
+BASE_DELAY = 10
+MAX_DELAY = 300
+JITTER = 0.5
+
+def backoff_delay(failures):
+    if failures <= 1:
+        return FIRST_DELAY
+
+    delay = min(MAX_DELAY, BASE_DELAY * 2 ** (failures - 2))
+    return delay * random.uniform(1 - JITTER, 1)
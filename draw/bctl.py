@@ -1,32 +1,47 @@
+import dbus
 import atexit
-import pexpect
 import threading
 import traceback
-from time import sleep
 from spawn import spawn
-from watch_bt import parse_address
+from gi.repository import GLib
+from dbus.mainloop.glib import DBusGMainLoop
+from watch_bt import parse_address, DEVICE_INTERFACE, DBUS_PROP_IFACE
+from bt_agent import BtAgent, Rejected, ADAPTER_INTERFACE, find_adapter, adapter_properties, set_adapter_property
 from spawn_stdin import spawn_stdin
 from spawn_socket import spawn_socket
-from time_helpers import is_past, seconds_from_now
-from socket_helpers import send_to_socket
+from time_helpers import is_past, seconds_from_now, wait_until
 from socket_helpers import send_to_socket, SOCKET_CAT, SOCKET_BCTL, SOCKET_BUTTONS, SOCKET_TRANSMITTER
-from stdout_logger import StdoutLogger
 
-BCTL_TIMEOUT = 5
+SYSTEM_ALIAS = "Martin"
 PKEY_TIMEOUT = 60
 PKEY_WARNING = 50
 CONFIRM_TIMEOUT = 15
 CONFIRM_WARNING = 10
-
-TIMER_INTERVAL = 1
-
-bctl = None
+PAIR_TIMEOUT = 5
+
+IDLE = "Idle"
+LOOKING = "Looking"
+CONFIRMING = "Confirming"
+PAIRING = "Pairing"
+
+bus = None
+adapter_path = None
+pair_state = IDLE
+pair_device = None
+pending_reply = None
 pkey = None
 warn_at = None
 reject_at = None
+main_loop = None
 timer_event = threading.Event()
 error_event = threading.Event()
 
+def manage_error():
+    error_event.wait()
+    print("An error occured. Exiting!")
+    if main_loop:
+        main_loop.quit()
+
 def manage_timer():
     try:
         while True:
@@ -41,7 +56,7 @@ def iterate_timer():
 
     if is_past(warn_at):
         new_warn_at(None)
-        if pkey:
+        if pair_state == CONFIRMING:
             send_to_socket(SOCKET_CAT, "Draw: Unsure about them")
             send_to_socket(SOCKET_BUTTONS, "Blink Fast: Blue")
         else:
@@ -50,159 +65,200 @@ def iterate_timer():
 
     if is_past(reject_at):
         new_reject_at(None)
-        close_bctl()
-        send_to_socket(SOCKET_CAT, "Flush: Didn't like them")
-        send_to_socket(SOCKET_CAT, "Lie Down!")
-        send_to_socket(SOCKET_BUTTONS, "Blink Short: Red")
-        send_to_socket(SOCKET_TRANSMITTER, "Unpause!")
-
-    if warn_at or reject_at:
-        sleep(TIMER_INTERVAL)
-    else:
-        timer_event.wait()
+        run_in_loop(reject_pairing, pair_state)
+
+    wait_until(timer_event, warn_at, reject_at)
+
+def run_in_loop(callback, *args):
+    def run():
+        try:
+            callback(*args)
+        except Exception as e:
+            print(f"An unexpected error occurred in the pairing loop: {e}")
+            traceback.print_exc()
+            error_event.set()
+        return False
+    GLib.idle_add(run)
 
 def handle_pair():
-    if not bctl:
-        new_warn_at(PKEY_WARNING)
-        new_reject_at(None)
+    if pair_state == IDLE:
+        start_looking()
+    elif pair_state == CONFIRMING:
+        confirm_pairing()
+    else:
+        print("Ignoring!")
 
-        send_to_socket(SOCKET_CAT, "Draw: Looking around")
-        send_to_socket(SOCKET_BUTTONS, "Blink Slow: Blue")
-        send_to_socket(SOCKET_TRANSMITTER, "Pause!")
-        wait_passkey()
+def start_looking():
+    new_pair_state(LOOKING)
+    new_pair_device(None)
+    new_warn_at(PKEY_WARNING)
+    new_reject_at(PKEY_TIMEOUT)
 
-        if pkey:
-            new_warn_at(CONFIRM_WARNING)
-            new_reject_at(CONFIRM_TIMEOUT)
+    send_to_socket(SOCKET_CAT, "Draw: Looking around")
+    send_to_socket(SOCKET_BUTTONS, "Blink Slow: Blue")
+    send_to_socket(SOCKET_TRANSMITTER, "Pause!")
 
-            send_to_socket(SOCKET_CAT, f"Befriend? {pkey}")
-            send_to_socket(SOCKET_BUTTONS, "Blink Slow: Blue")
-        else:
-            send_to_socket(SOCKET_CAT, "Flush: Nobody's around")
-            send_to_socket(SOCKET_CAT, "Lie Down!")
-            send_to_socket(SOCKET_BUTTONS, "Blink Short: Red")
-            send_to_socket(SOCKET_TRANSMITTER, "Unpause!")
-    elif pkey:
-        new_warn_at(None)
-        new_reject_at(None)
+    def set_discoverable():
+        set_adapter_property(bus, adapter_path, "Discoverable", dbus.Boolean(True))
 
-        address = pair_passkey()
-        if address:
-            send_to_socket(SOCKET_CAT, "Flush: Found a friend!")
-            send_to_socket(SOCKET_CAT, "Run Left!")
-            send_to_socket(SOCKET_BUTTONS, "Blink Short: Green")
-            send_to_socket(SOCKET_TRANSMITTER, f"Unpause: {address}")
-        else:
-            send_to_socket(SOCKET_CAT, "Flush: Can't be friends")
-            send_to_socket(SOCKET_CAT, "Lie Down!")
-            send_to_socket(SOCKET_BUTTONS, "Blink Short: Red")
-            send_to_socket(SOCKET_TRANSMITTER, "Unpause!")
-    else:
-        print("Ignoring!")
+    def set_alias():
+        set_adapter_property(bus, adapter_path, "Alias", SYSTEM_ALIAS, set_discoverable)
 
-def new_warn_at(in_seconds):
-    global warn_at
-    if in_seconds is None:
-        warn_at = None
-    else:
-        warn_at = seconds_from_now(in_seconds)
-    timer_event.set()
+    set_adapter_property(bus, adapter_path, "Powered", dbus.Boolean(True), set_alias)
 
-def new_reject_at(in_seconds):
-    global reject_at
-    if in_seconds is None:
-        reject_at = None
+def on_confirm(device, passkey, reply, error):
+    if pair_state != LOOKING:
+        print(f"Rejecting {device} asking to confirm {passkey}")
+        error(Rejected("Not looking for friends"))
+        return
+
+    new_pair_state(CONFIRMING)
+    new_pair_device(device)
+    new_pending_reply([reply, error])
+    new_pkey(passkey)
+    new_warn_at(CONFIRM_WARNING)
+    new_reject_at(CONFIRM_TIMEOUT)
+
+    send_to_socket(SOCKET_CAT, f"Befriend? {pkey}")
+    send_to_socket(SOCKET_BUTTONS, "Blink Slow: Blue")
+
+def confirm_pairing():
+    reply, _ = pending_reply
+    new_pending_reply(None)
+    new_pair_state(PAIRING)
+    new_warn_at(None)
+    new_reject_at(PAIR_TIMEOUT)
+    reply()
+
+def on_authorize(device, uuid, reply, error):
+    if device == pair_device:
+        print(f"Authorizing {uuid} for {device}")
+        reply()
     else:
-        reject_at = seconds_from_now(in_seconds)
-    timer_event.set()
+        print(f"Rejecting {uuid} for {device}")
+        error(Rejected("Not a new friend"))
 
-def close_bctl():
-    global bctl
+def on_device_change(interface, changed, invalidated, path):
+    if pair_state == PAIRING and path == pair_device and (changed.get("Paired") or changed.get("Bonded")):
+        finish_pairing(parse_address(path))
 
-    if not bctl:
+def finish_pairing(address):
+    if pair_state != PAIRING:
         return
 
-    try:
-        bctl.sendline("no")
-        bctl.sendline("discoverable off")
-        bctl.expect("Changing discoverable off succeeded")
-    except Exception as e:
-        print(f"Couldn't turn off discoverability due to {e}")
-    finally:
-        if bctl:
-            bctl.close()
-        bctl = None
+    new_pair_state(IDLE)
+    new_warn_at(None)
+    new_reject_at(None)
+    set_adapter_property(bus, adapter_path, "Discoverable", dbus.Boolean(False))
 
-def spawn_bctl():
-    global bctl
+    send_to_socket(SOCKET_CAT, "Flush: Found a friend!")
+    send_to_socket(SOCKET_CAT, "Run Left!")
+    send_to_socket(SOCKET_BUTTONS, "Blink Short: Green")
+    send_to_socket(SOCKET_TRANSMITTER, f"Unpause: {address}")
 
-    if bctl:
-        close_bctl()
+def reject_pairing(state):
+    if state != pair_state:
+        return
 
+    if pair_state == LOOKING:
+        report_failure("Nobody's around")
+    elif pair_state == CONFIRMING:
+        report_failure("Didn't like them")
+    elif pair_state == PAIRING:
+        report_failure("Can't be friends")
+    close_pairing()
+
+def on_cancel():
+    if pair_state in [CONFIRMING, PAIRING]:
+        print(f"{pair_device} canceled pairing")
+        report_failure("Can't be friends")
+        close_pairing()
+
+def close_pairing():
+    if pending_reply:
+        _, error = pending_reply
+        error(Rejected("Pairing closed"))
+
+    new_pair_device(None)
+    new_pending_reply(None)
+    new_pkey(None)
+    new_pair_state(IDLE)
+    new_warn_at(None)
+    new_reject_at(None)
+    set_adapter_property(bus, adapter_path, "Discoverable", dbus.Boolean(False))
+
+def report_failure(message):
+    send_to_socket(SOCKET_CAT, f"Flush: {message}")
+    send_to_socket(SOCKET_CAT, "Lie Down!")
+    send_to_socket(SOCKET_BUTTONS, "Blink Short: Red")
+    send_to_socket(SOCKET_TRANSMITTER, "Unpause!")
+
+def hide_adapter():
     try:
-        bctl = pexpect.spawn("bluetoothctl")
-        bctl.logfile = StdoutLogger()
-        bctl.timeout = BCTL_TIMEOUT
-        bctl.expect("#")
+        adapter_properties(bus, adapter_path).Set(ADAPTER_INTERFACE, "Discoverable", dbus.Boolean(False))
     except Exception as e:
-        print(f"Couldn't spawn bluetoothctl due to {e}")
-        close_bctl()
+        print(f"Couldn't turn off discoverability due to {e}")
 
-def wait_passkey():
-    global pkey
+def new_pair_state(value):
+    global pair_state
+    print(f"Pairing state {pair_state} -> {value}")
+    pair_state = value
 
-    spawn_bctl()
+def new_pair_device(value):
+    global pair_device
+    pair_device = value
 
-    if not bctl:
-        return
+def new_pending_reply(value):
+    global pending_reply
+    pending_reply = value
 
-    try:
-        pkey = None
-        bctl.sendline("power on")
-        bctl.expect("Changing power on succeeded")
-        bctl.sendline("system-alias Martin")
-        bctl.expect("Changing Martin succeeded")
-        bctl.sendline("discoverable on")
-        bctl.expect("Changing discoverable on succeeded")
-        bctl.sendline("default-agent")
-        bctl.expect(r"Confirm passkey (\d+)", timeout=PKEY_TIMEOUT)
-        pkey = bctl.match.group(1).decode("utf-8")
-    except Exception as e:
-        print(f"Couldn't receive a passkey due to {e}")
-        close_bctl()
-
-def pair_passkey():
-    try:
-        bctl.sendline("yes")
-        bctl.expect(r"Authorize service|[\w:]+ Bonded: yes")
-        match = bctl.match.group(0).decode("utf-8")
+def new_pkey(value):
+    global pkey
+    pkey = value
 
-        if "Authorize service" in match:
-            bctl.sendline("yes")
-            bctl.expect(r"Player [\w\/_]+")
-            match = bctl.match.group(0).decode("utf-8")
+def new_warn_at(in_seconds):
+    global warn_at
+    if in_seconds is None:
+        warn_at = None
+    else:
+        warn_at = seconds_from_now(in_seconds)
+    timer_event.set()
 
-        return parse_address(match)
-    except Exception as e:
-        print(f"Couldn't pair due to {e}")
-        return False
-    finally:
-        close_bctl()
+def new_reject_at(in_seconds):
+    global reject_at
+    if in_seconds is None:
+        reject_at = None
+    else:
+        reject_at = seconds_from_now(in_seconds)
+    timer_event.set()
 
 def process_line(line):
     print(f"Processing {line}")
     if line == "Pair!":
-        handle_pair()
+        run_in_loop(handle_pair)
     elif line == "Close!":
-        close_bctl()
+        run_in_loop(close_pairing)
     else:
         print(f"Unknown {line}")
 
-atexit.register(close_bctl)
-
+DBusGMainLoop(set_as_default=True)
+bus = dbus.SystemBus()
+adapter_path = find_adapter(bus)
+agent = BtAgent(bus, on_confirm, on_authorize, on_cancel)
+agent.register()
+bus.add_signal_receiver(
+    on_device_change,
+    dbus_interface=DBUS_PROP_IFACE,
+    signal_name='PropertiesChanged',
+    arg0=DEVICE_INTERFACE,
+    path_keyword='path'
+)
+atexit.register(hide_adapter)
+
+main_loop = GLib.MainLoop()
+error_thread = spawn(manage_error)
 timer_thread = spawn(manage_timer)
 stdin_thread = spawn_stdin(process_line, error_event)
 socket_thread = spawn_socket(SOCKET_BCTL, process_line, error_event)
 
-error_event.wait()
-print("An error occured. Exiting!")
+main_loop.run()
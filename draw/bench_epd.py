@@ -0,0 +1,126 @@
+import os
+import sys
+import types
+from time import perf_counter
+
+ROOT_PATH = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(ROOT_PATH, "lib"))
+
+SPI_HZ = 4000000
+ROUNDS = 50
+TEXT = "You are beautiful"
+FRAMES = [["cat_run_left", frame] for frame in range(1, 5)]
+
+class RecordingSpi:
+    RST_PIN = 17
+    DC_PIN = 25
+    CS_PIN = 8
+    BUSY_PIN = 24
+    PWR_PIN = 18
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.transactions = 0
+        self.gpio_writes = 0
+        self.bytes = 0
+
+    def digital_write(self, pin, value):
+        self.gpio_writes += 1
+
+    def digital_read(self, pin):
+        return 0
+
+    def delay_ms(self, delaytime):
+        pass
+
+    def wait_for_idle(self, pin, timeout):
+        return True
+
+    def spi_writebyte(self, data):
+        self.transactions += 1
+        self.bytes += len(data)
+
+    def spi_writebyte2(self, data):
+        self.transactions += 1
+        self.bytes += len(data)
+
+    def module_init(self, cleanup=False):
+        return 0
+
+    def module_exit(self, cleanup=False):
+        pass
+
+spi = RecordingSpi()
+epdconfig = types.ModuleType("waveshare_epd.epdconfig")
+for name in [x for x in dir(spi) if not x.startswith("_")]:
+    setattr(epdconfig, name, getattr(spi, name))
+sys.modules["waveshare_epd.epdconfig"] = epdconfig
+
+import display_helpers
+
+def legacy_partial(epd, image):
+    epdconfig.digital_write(epd.reset_pin, 0)
+    epdconfig.delay_ms(1)
+    epdconfig.digital_write(epd.reset_pin, 1)
+
+    epd.send_command(0x3C)
+    epd.send_data(0x80)
+    epd.send_command(0x01)
+    epd.send_data(0xF9)
+    epd.send_data(0x00)
+    epd.send_data(0x00)
+    epd.send_command(0x11)
+    epd.send_data(0x03)
+
+    epd.send_command(0x44)
+    epd.send_data(0x00)
+    epd.send_data((epd.width - 1) >> 3)
+    epd.send_command(0x45)
+    epd.send_data(0x00)
+    epd.send_data(0x00)
+    epd.send_data((epd.height - 1) & 0xFF)
+    epd.send_data((epd.height - 1) >> 8)
+
+    epd.send_command(0x4E)
+    epd.send_data(0x00)
+    epd.send_command(0x4F)
+    epd.send_data(0x00)
+    epd.send_data(0x00)
+
+    epd.send_command(0x24)
+    epd.send_data2(image)
+
+    epd.send_command(0x22)
+    epd.send_data(0xFF)
+    epd.send_command(0x20)
+    epd.ReadBusy()
+
+def bench(name, draw, buffers):
+    spi.reset()
+    started_at = perf_counter()
+    for _ in range(ROUNDS):
+        for buffer in buffers:
+            draw(buffer)
+    elapsed = perf_counter() - started_at
+
+    count = ROUNDS * len(buffers)
+    print(f"{name}:")
+    print(f"  {spi.transactions / count:.0f} SPI transactions, {spi.gpio_writes / count:.0f} GPIO writes, {spi.bytes / count:.0f} bytes per frame")
+    print(f"  {spi.bytes * 8 / SPI_HZ / count * 1000:.2f}ms on the bus at {SPI_HZ // 1000000}MHz, {elapsed / count * 1000000:.0f}us in Python per frame")
+
+def draw_windowed(buffer):
+    display_helpers.draw_display(buffer)
+
+if __name__ == "__main__":
+    epd = display_helpers.epd
+    display_helpers.load_frames()
+    buffers = [display_helpers.with_text(state, frame, TEXT, False) for state, frame in FRAMES]
+
+    bench("Per-byte partial refresh", lambda buffer: legacy_partial(epd, buffer), buffers)
+    bench("Batched partial refresh", epd.displayPartial, buffers)
+
+    display_helpers.display_ready = True
+    display_helpers.sent_buffer = buffers[-1]
+    bench("Batched windowed refresh", draw_windowed, buffers)
@@ -0,0 +1,98 @@
+import random
+from time import perf_counter_ns
+from evdev import ecodes
+from hid_helpers import KEYTABLE, MODKEYS, TARGET_LENGTH, BootReport
+
+EVENT_COUNT = 200000
+ROUNDS = 10
+
+TYPED_KEYS = ["KEY_A", "KEY_S", "KEY_D", "KEY_F", "KEY_J", "KEY_K", "KEY_L", "KEY_SPACE", "KEY_E", "KEY_R", "KEY_U", "KEY_I"]
+HELD_KEYS = ["KEY_LEFTSHIFT", "KEY_LEFTCTRL"]
+
+mod_keys = 0
+pressed_keys = [0] * TARGET_LENGTH
+
+def legacy_update(code, value):
+    key_str = ecodes.KEY[code]
+    mod_key = legacy_to_mod_key(key_str)
+    ord_key = legacy_to_ord_key(key_str)
+
+    if mod_key != -1:
+        legacy_update_mod_keys(mod_key, value)
+    elif ord_key != -1:
+        legacy_update_ord_keys(ord_key, value)
+
+    return [0xA1, 0x01, mod_keys, 0, *pressed_keys]
+
+def legacy_to_mod_key(key_str):
+    if key_str in MODKEYS:
+        return MODKEYS[key_str]
+    else:
+        return -1
+
+def legacy_to_ord_key(key_str):
+    if key_str in KEYTABLE:
+        return KEYTABLE[key_str]
+    else:
+        return -1
+
+def legacy_update_mod_keys(mod_key, value):
+    global mod_keys
+    bit_mask = 1 << (7 - mod_key)
+    if value:
+        mod_keys |= bit_mask
+    else:
+        mod_keys &= ~bit_mask
+
+def legacy_update_ord_keys(ord_key, value):
+    global pressed_keys
+    if value == 0:
+        if ord_key in pressed_keys:
+            pressed_keys.remove(ord_key)
+    elif ord_key not in pressed_keys:
+        pressed_keys.insert(0, ord_key)
+
+    len_delta = TARGET_LENGTH - len(pressed_keys)
+    if len_delta < 0:
+        pressed_keys = pressed_keys[:len_delta]
+    elif len_delta > 0:
+        pressed_keys.extend([0] * len_delta)
+
+def make_events(count):
+    rng = random.Random(0)
+    events = []
+    while len(events) < count:
+        held = rng.random() < 0.2 and rng.choice(HELD_KEYS)
+        if held:
+            events.append((ecodes.ecodes[held], 1))
+        for key_str in rng.sample(TYPED_KEYS, rng.randint(1, 3)):
+            events.append((ecodes.ecodes[key_str], 1))
+            events.append((ecodes.ecodes[key_str], 0))
+        if held:
+            events.append((ecodes.ecodes[held], 0))
+    return events[:count]
+
+def bench_legacy(events):
+    started_at = perf_counter_ns()
+    for code, value in events:
+        legacy_update(code, value)
+    return perf_counter_ns() - started_at
+
+def bench_compiled(events):
+    update = BootReport().update
+    started_at = perf_counter_ns()
+    for code, value in events:
+        update(code, value)
+    return perf_counter_ns() - started_at
+
+def best_of(bench, events):
+    return min(bench(events) for _ in range(ROUNDS)) / len(events)
+
+events = make_events(EVENT_COUNT)
+legacy_ns = best_of(bench_legacy, events)
+compiled_ns = best_of(bench_compiled, events)
+
+print(f"Events: {len(events)}, best of {ROUNDS} rounds")
+print(f"Before (string lookups, list report): {legacy_ns:.0f} ns/event")
+print(f"After (compiled table, in-place report): {compiled_ns:.0f} ns/event")
+print(f"Speedup: {legacy_ns / compiled_ns:.2f}x")
@@ -0,0 +1,121 @@
+import os
+import sys
+import glob
+import threading
+from time import time, sleep, perf_counter, thread_time
+from evdev import InputDevice, InputEvent, ecodes
+from frame_helpers import unpack_frame
+from stats_helpers import RollingStats
+from socket_helpers import PacketSender
+from spawn_socket import spawn_packets
+import input_relay
+
+ROOT_PATH = os.path.dirname(os.path.realpath(__file__))
+RECORDINGS_PATH = os.path.join(ROOT_PATH, "recordings")
+SOCKET_BENCH = "/tmp/bench_reports_socket"
+REALTIME_FLAG = "--realtime"
+DRAIN_TIMEOUT = 5
+
+received = []
+received_event = threading.Event()
+error_event = threading.Event()
+
+def process_packet(packet):
+    received.append([time(), packet])
+    received_event.set()
+
+def read_recording(path):
+    frames = []
+    events = []
+    with open(path, "r") as file:
+        for line in file:
+            timestamp, event_type, code, value = line.split()
+            event = InputEvent(0, 0, int(event_type), int(code), int(value))
+            events.append(event)
+            if event.type == ecodes.EV_SYN and event.code == ecodes.SYN_REPORT:
+                frames.append([float(timestamp), events])
+                events = []
+    return frames
+
+def reset_relay():
+    input_relay.keys = type(input_relay.keys)()
+    input_relay.sent_report = bytes(input_relay.keys.report)
+
+def replay(frames, realtime):
+    cpu_time = 0
+    first_at = frames[0][0]
+    started_at = perf_counter()
+
+    for timestamp, events in frames:
+        if realtime:
+            sleep(max(0, started_at + timestamp - first_at - perf_counter()))
+
+        now = time()
+        events[-1].sec = int(now)
+        events[-1].usec = int((now - int(now)) * 1000000)
+
+        cpu_started_at = thread_time()
+        input_relay.process_events(events)
+        cpu_time += thread_time() - cpu_started_at
+
+    return [perf_counter() - started_at, cpu_time]
+
+def wait_for_reports(count):
+    deadline = perf_counter() + DRAIN_TIMEOUT
+    while len(received) < count and perf_counter() < deadline:
+        received_event.wait(0.1)
+        received_event.clear()
+
+def bench(path, sender, realtime):
+    frames = read_recording(path)
+    event_count = sum(len(events) for _, events in frames)
+
+    sent = []
+    def report_sink(frame):
+        sent.append(frame)
+        sender.send(frame)
+
+    input_relay.report_sink = report_sink
+    received.clear()
+    reset_relay()
+
+    wall_time, cpu_time = replay(frames, realtime)
+    wait_for_reports(len(sent))
+
+    latency_stats = RollingStats("Latency", max(1, len(received)))
+    for received_at, packet in received:
+        event_at, _, _ = unpack_frame(packet)
+        latency_stats.add(received_at - event_at)
+
+    print(f"{os.path.basename(path)}: {event_count} events, {len(received)}/{len(sent)} reports")
+    print(f"  Throughput: {event_count / wall_time:.0f} events/s, {len(received) / wall_time:.0f} reports/s")
+    print(f"  {latency_stats.describe()}")
+    print(f"  CPU: {cpu_time * 1000:.1f}ms, {cpu_time / event_count * 1000000:.2f}us/event")
+
+def bench_all(paths, realtime):
+    spawn_packets(SOCKET_BENCH, process_packet, error_event)
+    sleep(0.1)
+    sender = PacketSender(SOCKET_BENCH)
+    print(f"Report: {type(input_relay.keys).__name__}, realtime: {realtime}")
+    for path in paths:
+        bench(path, sender, realtime)
+    if error_event.is_set():
+        print("The stand-in transmitter failed!")
+
+def record(device_path, output_path):
+    device = InputDevice(device_path)
+    print(f"Recording {device.name} to {output_path}, press Ctrl+C to stop")
+    with open(output_path, "w") as file:
+        try:
+            for event in device.read_loop():
+                file.write(f"{event.timestamp():.6f} {event.type} {event.code} {event.value}\n")
+        except KeyboardInterrupt:
+            print("Stopped recording")
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    if args and args[0] == "record":
+        record(args[1], args[2])
+    else:
+        paths = args or sorted(glob.glob(os.path.join(RECORDINGS_PATH, "*.events")))
+        bench_all(paths, REALTIME_FLAG in sys.argv)
@@ -0,0 +1,120 @@
+import os
+import sys
+import tempfile
+from time import time, sleep, perf_counter
+from spawn import spawn
+from watch_bt import watch_bt
+from btkeyboard import BtKeyboard
+from stats_helpers import RollingStats
+from frame_helpers import pack_frame
+from fake_bluez import FakeBluez, FakeHost
+import history_helpers
+import last_address_helpers
+import transmitter
+
+HOST_ADDRESS = "0A:00:00:00:00:01"
+OTHER_ADDRESS = "0A:00:00:00:00:02"
+CONNECT_TIMEOUT = 30
+CONNECT_POLL_TIME = 0.001
+SETTLE_DELAY = transmitter.SHORT_DELAY + 0.5
+RECONNECT_ROUNDS = 3
+REPORT_COUNT = 5000
+PRESSED_REPORT = bytes([0xA1, 1, 0, 0, 30, 0, 0, 0, 0, 0])
+RELEASED_REPORT = bytes([0xA1, 1, 0, 0, 0, 0, 0, 0, 0, 0])
+
+def start(bluez):
+    state_path = tempfile.mkdtemp()
+    history_helpers.HISTORY_PATH = os.path.join(state_path, "host_history")
+    last_address_helpers.LAST_ADDRESS_PATH = os.path.join(state_path, "last_address")
+    transmitter.host_history.clear()
+    transmitter.btkeyboard = BtKeyboard(on_send=transmitter.on_send, bus=bluez, transport=bluez.channel)
+    transmitter.watch_loop = watch_bt(transmitter.on_bt_change, transmitter.on_bt_seen, bluez)
+    spawn(transmitter.manage_error)
+    spawn(transmitter.manage_timer)
+
+def wait_for_disconnect(host):
+    if not host.disconnected_event.wait(CONNECT_TIMEOUT):
+        raise Exception(f"{host.address} didn't disconnect in {CONNECT_TIMEOUT}s")
+
+def wait_for_connect(host, started_at=None):
+    started_at = started_at or perf_counter()
+    deadline = perf_counter() + CONNECT_TIMEOUT
+    while perf_counter() < deadline:
+        if host.connected_event.wait(max(0, deadline - perf_counter())) and transmitter.is_connected():
+            return perf_counter() - started_at
+        sleep(CONNECT_POLL_TIME)
+    raise Exception(f"{host.address} didn't connect in {CONNECT_TIMEOUT}s")
+
+def bench_connect(host):
+    transmitter.new_target(host.address)
+    transmitter.new_attempt_at(transmitter.ZERO_DELAY)
+    print(f"Connect: {wait_for_connect(host) * 1000:.0f}ms")
+
+def bench_reconnect(host):
+    stats = RollingStats("Reconnect", RECONNECT_ROUNDS)
+    for _ in range(RECONNECT_ROUNDS):
+        sleep(SETTLE_DELAY)
+        started_at = perf_counter()
+        host.unplug()
+        wait_for_disconnect(host)
+        stats.add(wait_for_connect(host, started_at))
+    print(stats.describe())
+
+def bench_stall(host):
+    sleep(SETTLE_DELAY)
+    started_at = perf_counter()
+    host.stall()
+    sender_thread = spawn(send_reports, REPORT_COUNT)
+    wait_for_disconnect(host)
+    print(f"Stall recovery: {wait_for_connect(host, started_at) * 1000:.0f}ms")
+    sender_thread.join(CONNECT_TIMEOUT)
+
+def bench_switch(host, other_host):
+    sleep(SETTLE_DELAY)
+    transmitter.process_line("Next!")
+    print(f"Switch: {wait_for_connect(other_host) * 1000:.0f}ms")
+    sleep(SETTLE_DELAY)
+    transmitter.process_line("Next!")
+    wait_for_connect(host)
+
+def send_reports(count):
+    for index in range(count):
+        report = PRESSED_REPORT if index % 2 == 0 else RELEASED_REPORT
+        transmitter.process_packet(pack_frame(report, time()))
+
+def bench_throughput(host):
+    host.reports.clear()
+    transmitter.btkeyboard.total_stats.clear()
+    started_at = perf_counter()
+    send_reports(REPORT_COUNT)
+
+    deadline = perf_counter() + CONNECT_TIMEOUT
+    while len(host.reports) < REPORT_COUNT and perf_counter() < deadline:
+        host.report_event.wait(0.1)
+        host.report_event.clear()
+
+    wall_time = perf_counter() - started_at
+    print(f"Throughput: {len(host.reports)}/{REPORT_COUNT} reports, {len(host.reports) / wall_time:.0f} reports/s")
+    print(transmitter.btkeyboard.total_stats.describe())
+
+if __name__ == "__main__":
+    bluez = FakeBluez()
+    host = FakeHost(bluez, HOST_ADDRESS, "Host")
+    other_host = FakeHost(bluez, OTHER_ADDRESS, "Other")
+    host.come_around()
+    other_host.come_around()
+    start(bluez)
+
+    try:
+        bench_connect(host)
+        bench_throughput(host)
+        bench_reconnect(host)
+        bench_stall(host)
+        bench_switch(host, other_host)
+    finally:
+        host.go_away()
+        other_host.go_away()
+
+    if transmitter.error_event.is_set():
+        print("The transmitter failed!")
+        sys.exit(1)
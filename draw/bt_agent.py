@@ -0,0 +1,81 @@
+import dbus
+import dbus.service
+from watch_bt import DBUS_PROP_IFACE, get_managed_objects
+
+AGENT_INTERFACE = "org.bluez.Agent1"
+AGENT_MANAGER_INTERFACE = "org.bluez.AgentManager1"
+ADAPTER_INTERFACE = "org.bluez.Adapter1"
+AGENT_PATH = "/martin/agent"
+AGENT_CAPABILITY = "DisplayYesNo"
+
+class Rejected(dbus.DBusException):
+    _dbus_error_name = "org.bluez.Error.Rejected"
+
+def find_adapter(bus):
+    for path, interfaces in get_managed_objects(bus).items():
+        if ADAPTER_INTERFACE in interfaces:
+            return path
+    raise Exception("no adapter found!")
+
+def adapter_properties(bus, adapter_path):
+    return dbus.Interface(bus.get_object("org.bluez", adapter_path), DBUS_PROP_IFACE)
+
+def set_adapter_property(bus, adapter_path, name, value, on_done=None):
+    def on_reply():
+        print(f"Changed {name} to {value}")
+        if on_done:
+            on_done()
+
+    def on_error(e):
+        print(f"Couldn't change {name} to {value} due to {e}")
+
+    adapter_properties(bus, adapter_path).Set(ADAPTER_INTERFACE, name, value, reply_handler=on_reply, error_handler=on_error)
+
+class BtAgent(dbus.service.Object):
+    def __init__(self, bus, on_confirm, on_authorize, on_cancel):
+        super().__init__(bus, AGENT_PATH)
+        self.bus = bus
+        self.on_confirm = on_confirm
+        self.on_authorize = on_authorize
+        self.on_cancel = on_cancel
+
+    def register(self):
+        manager = dbus.Interface(self.bus.get_object("org.bluez", "/org/bluez"), AGENT_MANAGER_INTERFACE)
+        manager.RegisterAgent(AGENT_PATH, AGENT_CAPABILITY)
+        manager.RequestDefaultAgent(AGENT_PATH)
+
+    @dbus.service.method(AGENT_INTERFACE, in_signature="", out_signature="")
+    def Release(self):
+        print("Agent released")
+
+    @dbus.service.method(AGENT_INTERFACE, in_signature="ou", out_signature="", async_callbacks=("reply", "error"))
+    def RequestConfirmation(self, device, passkey, reply, error):
+        self.on_confirm(device, f"{passkey:06d}", reply, error)
+
+    @dbus.service.method(AGENT_INTERFACE, in_signature="os", out_signature="", async_callbacks=("reply", "error"))
+    def AuthorizeService(self, device, uuid, reply, error):
+        self.on_authorize(device, uuid, reply, error)
+
+    @dbus.service.method(AGENT_INTERFACE, in_signature="o", out_signature="")
+    def RequestAuthorization(self, device):
+        raise Rejected("Pairing without a passkey isn't supported")
+
+    @dbus.service.method(AGENT_INTERFACE, in_signature="o", out_signature="s")
+    def RequestPinCode(self, device):
+        raise Rejected("Pairing with a PIN code isn't supported")
+
+    @dbus.service.method(AGENT_INTERFACE, in_signature="o", out_signature="u")
+    def RequestPasskey(self, device):
+        raise Rejected("Entering a passkey isn't supported")
+
+    @dbus.service.method(AGENT_INTERFACE, in_signature="ouq", out_signature="")
+    def DisplayPasskey(self, device, passkey, entered):
+        print(f"{device} entered {entered} digits of {passkey:06d}")
+
+    @dbus.service.method(AGENT_INTERFACE, in_signature="os", out_signature="")
+    def DisplayPinCode(self, device, pincode):
+        print(f"{device} shows {pincode}")
+
+    @dbus.service.method(AGENT_INTERFACE, in_signature="", out_signature="")
+    def Cancel(self):
+        self.on_cancel()
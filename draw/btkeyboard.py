@@ -1,24 +1,62 @@
 import os
 import dbus
+import errno
+import queue
 import socket
+import select
+import selectors
+import threading
 import traceback
-from time import sleep
+from time import sleep, time, perf_counter, monotonic
+from spawn import spawn
+from stats_helpers import RollingStats
+from hidp_helpers import CONTROL_VIRTUAL_CABLE_UNPLUG, DATA, GET_IDLE, GET_PROTOCOL, GET_REPORT, HANDSHAKE_INVALID_REPORT_ID, HANDSHAKE_SUCCESSFUL, HANDSHAKE_UNSUPPORTED_REQUEST, HID_CONTROL, PARAM_MASK, PROTOCOL_BOOT, PROTOCOL_REPORT, REPORT_ID_BOOT, REPORT_LENGTH, REPORT_TYPE_INPUT, REPORT_TYPE_MASK, REPORT_TYPE_OUTPUT, SET_IDLE, SET_PROTOCOL, SET_REPORT, TYPE_MASK, data, handshake, parse_leds, to_boot_report
+from watch_bt import read_devices, parse_devices, get_managed_objects, DEVICE_INTERFACE
+from bt_agent import ADAPTER_INTERFACE, find_adapter
 from dbus.mainloop.glib import DBusGMainLoop
 
+def l2cap_socket():
+    return socket.socket(socket.AF_BLUETOOTH, socket.SOCK_SEQPACKET, socket.BTPROTO_L2CAP)
+
 class BtKeyboard:
     UUID = "00001124-0000-1000-8000-00805f9b34fb"
     P_CTRL = 17
     P_INTR = 19
     SDP_RECORD_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "btkbdevice.xml")
     PROFILE_DBUS_PATH = "/bluez/yaptb/btkb_profile"
+    REPORT_QUEUE_SIZE = 64
+    CONNECT_TIMEOUT = 15
+    MESSAGE_SIZE = 64
+    LINK_WINDOW_SIZE = 20
 
-    def __init__(self, hci=0):
+    def __init__(self, hci=0, on_leds=None, on_send=None, bus=None, transport=l2cap_socket):
         DBusGMainLoop(set_as_default=True)
-        self.bus = dbus.SystemBus()
+        self.bus = bus or dbus.SystemBus()
+        self.transport = transport
         self.target = None
+        self.discovery_target = None
         self.ccontrol = None
         self.cinterrupt = None
+        self.on_leds = on_leds
+        self.on_send = on_send
+        self.protocol = PROTOCOL_REPORT
+        self.idle_rate = 0
+        self.leds = 0
+        self.last_reports = {}
+        self.dropped_reports = 0
+        self.lock = threading.RLock()
+        self.waker, self.wakee = socket.socketpair()
+        self.reports = queue.Queue(self.REPORT_QUEUE_SIZE)
+        self.block_stats = RollingStats("Blocking")
+        self.wait_stats = RollingStats("Waiting")
+        self.send_stats = RollingStats("Sending")
+        self.total_stats = RollingStats("Total")
+        self.link_stats = RollingStats("Link sending", self.LINK_WINDOW_SIZE)
+        self.error_stats = RollingStats("Link errors", self.LINK_WINDOW_SIZE)
+        self.sending_at = None
         self.register_hid_profile()
+        self.sender_thread = spawn(self.manage_sender)
+        self.reader_thread = spawn(self.manage_reader)
 
     def register_hid_profile(self):
         record = self.read_sdp_record()
@@ -33,76 +71,349 @@ class BtKeyboard:
 
     @property
     def devices(self):
-        proxy_object = self.bus.get_object("org.bluez", "/")
-        managed_objects = dbus.Interface(proxy_object, "org.freedesktop.DBus.ObjectManager").GetManagedObjects()
-        connected_devices = []
-        for path in managed_objects:
-            device = managed_objects[path].get("org.bluez.Device1", {})
-            alias = device.get("Alias")
-            address = device.get("Address")
-            paired = device.get("Paired", False)
-            connected = device.get("Connected", False)
-            if address and alias and (paired or connected):
-                connected_devices.append({ "address": address, "alias": alias, "paired": paired, "connected": connected })
-        return connected_devices
+        devices = read_devices()
+        if devices is None:
+            devices = self.read_managed_devices()
+        return devices
+
+    def read_managed_devices(self):
+        managed_objects = get_managed_objects(self.bus)
+        return parse_devices(interfaces.get(DEVICE_INTERFACE, {}) for interfaces in managed_objects.values())
 
     def connect(self, target):
+        connected_target, _ = self.connect_any([target])
+        return connected_target == target
+
+    def connect_any(self, targets):
+        self.disconnect()
+        with self.lock:
+            self.target = targets[0] if len(targets) == 1 else None
+
+        failed_targets = []
+        target, ccontrol, cinterrupt = self.open_channels(targets, failed_targets)
+        if not target:
+            return [None, failed_targets]
+
         try:
-            self.disconnect()
-            self.target = target
-            self.ccontrol = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_SEQPACKET, socket.BTPROTO_L2CAP)
-            self.ccontrol.connect((self.target, self.P_CTRL))
-            self.cinterrupt = socket.socket(socket.AF_BLUETOOTH, socket.SOCK_SEQPACKET, socket.BTPROTO_L2CAP)
-            self.cinterrupt.connect((self.target, self.P_INTR))
-            if not self.is_connected:
+            with self.lock:
+                self.target = target
+                self.ccontrol = ccontrol
+                self.cinterrupt = cinterrupt
+                self.protocol = PROTOCOL_REPORT
+                self.idle_rate = 0
+                self.last_reports = {}
+                self.dropped_reports = 0
+            self.wake_reader()
+
+            if not self.check_connected(fresh=True):
                 raise Exception("It says it's connected but it's not!")
 
-            return True
+            return [target, failed_targets]
         except Exception as e:
-            print(f"Couldn't connect to {self.target} due to {e}")
+            print(f"Couldn't connect to {target} due to {e}")
             print("Going to disconnect!")
             self.disconnect()
+            return [None, failed_targets + [target]]
+
+    def open_channels(self, targets, failed_targets):
+        selector = selectors.DefaultSelector()
+        try:
+            for target in targets:
+                self.open_channel(selector, target, self.P_CTRL, None, failed_targets)
+
+            deadline = monotonic() + self.CONNECT_TIMEOUT
+            while selector.get_map() and monotonic() < deadline:
+                for key, _ in selector.select(deadline - monotonic()):
+                    channel = key.fileobj
+                    target, ccontrol = key.data
+                    selector.unregister(channel)
+
+                    error = channel.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if error:
+                        print(f"Couldn't connect to {target} due to {os.strerror(error)}")
+                        failed_targets.append(target)
+                        self.close_socket(channel, "channel")
+                        self.close_socket(ccontrol, "ccontrol")
+                    elif not ccontrol:
+                        self.open_channel(selector, target, self.P_INTR, channel, failed_targets)
+                    else:
+                        ccontrol.setblocking(True)
+                        channel.setblocking(True)
+                        return [target, ccontrol, channel]
+
+            print(f"Couldn't connect to any of {targets} in time")
+            failed_targets.extend(key.data[0] for key in selector.get_map().values())
+            return [None, None, None]
+        finally:
+            for key in list(selector.get_map().values()):
+                self.close_socket(key.fileobj, "channel")
+                self.close_socket(key.data[1], "ccontrol")
+            selector.close()
+
+    def open_channel(self, selector, target, psm, ccontrol, failed_targets):
+        channel = self.transport()
+        channel.setblocking(False)
+        error = channel.connect_ex((target, psm))
+        if error in [0, errno.EINPROGRESS, errno.EAGAIN]:
+            selector.register(channel, selectors.EVENT_WRITE, [target, ccontrol])
+        else:
+            print(f"Couldn't connect to {target} due to {os.strerror(error)}")
+            failed_targets.append(target)
+            self.close_socket(channel, "channel")
+            self.close_socket(ccontrol, "ccontrol")
 
     def disconnect(self):
-        if self.ccontrol:
+        with self.lock:
+            ccontrol = self.ccontrol
+            cinterrupt = self.cinterrupt
+            self.ccontrol = None
+            self.cinterrupt = None
+
+        self.close_socket(ccontrol, "ccontrol")
+        self.close_socket(cinterrupt, "cinterrupt")
+        self.wake_reader()
+
+    def close_socket(self, channel, name):
+        if channel:
             try:
-                self.ccontrol.close()
-            except Exception as e:
-                print(f"Couldn't close ccontrol due to {e}")
-            finally:
-                self.ccontrol = None
+                channel.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
 
-        if self.cinterrupt:
             try:
-                self.cinterrupt.close()
+                channel.close()
             except Exception as e:
-                print(f"Couldn't close cinterrupt due to {e}")
-            finally:
-                self.cinterrupt = None
+                print(f"Couldn't close {name} due to {e}")
 
     @property
     def is_connected(self):
+        return self.check_connected()
+
+    def check_connected(self, fresh=False):
         try:
-            if not self.ccontrol or not self.cinterrupt:
+            with self.lock:
+                target = self.target
+                ccontrol = self.ccontrol
+                cinterrupt = self.cinterrupt
+
+            if not ccontrol or not cinterrupt:
                 return False
 
-            if self.ccontrol.getpeername()[0] != self.target or self.cinterrupt.getpeername()[0] != self.target:
+            if ccontrol.getpeername()[0] != target or cinterrupt.getpeername()[0] != target:
                 return False
 
-            for device in self.devices:
-                if device["address"] == self.target and device["connected"]:
+            devices = self.read_managed_devices() if fresh else self.devices
+            for device in devices:
+                if device["address"] == target and device["connected"]:
                     return True
         except Exception as e:
             print(f"Couldn't check if {self.target} is connected due to {e}")
             return False
 
-    def send(self, msg):
+    @property
+    def rssi(self):
+        for device in self.devices:
+            if device["address"] == self.target:
+                return device.get("rssi")
+
+    def discover(self, target):
+        if target == self.discovery_target:
+            return
+
+        discovery_target = self.discovery_target
+        self.discovery_target = target
         try:
-            self.cinterrupt.send(bytes(bytearray(msg)))
+            adapter = dbus.Interface(self.bus.get_object("org.bluez", find_adapter(self.bus)), ADAPTER_INTERFACE)
+            if discovery_target:
+                print(f"Stopping looking for {discovery_target}")
+                adapter.StopDiscovery()
+            if target:
+                print(f"Looking for {target}")
+                adapter.SetDiscoveryFilter({ "Pattern": target, "DuplicateData": True })
+                adapter.StartDiscovery()
         except Exception as e:
-            print(f"Couldn't send to {self.target} due to {e}")
-            print("Going to disconnect!")
-            self.disconnect()
+            print(f"Couldn't change looking for {discovery_target} to {target} due to {e}")
+
+    def clear_link_stats(self):
+        self.link_stats.clear()
+
+    @property
+    def send_age(self):
+        sending_at = self.sending_at
+        return perf_counter() - sending_at if sending_at else 0
+
+    @property
+    def queue_depth(self):
+        return self.reports.qsize()
+
+    @property
+    def stats(self):
+        return [self.block_stats, self.wait_stats, self.send_stats, self.total_stats]
+
+    def send(self, msg, event_at=None):
+        started_at = perf_counter()
+        self.reports.put([bytes(msg), event_at, perf_counter()])
+        self.block_stats.add(perf_counter() - started_at)
+
+    def manage_sender(self):
+        while True:
+            try:
+                self.iterate_sender()
+            except Exception as e:
+                print(f"An unexpected error occurred in the sender: {e}")
+                traceback.print_exc()
+                print("Carrying on")
+
+    def iterate_sender(self):
+        msg, event_at, queued_at = self.reports.get()
+        started_at = perf_counter()
+        self.wait_stats.add(started_at - queued_at)
+
+        with self.lock:
+            target = self.target
+            cinterrupt = self.cinterrupt
+            if not cinterrupt:
+                if not self.dropped_reports:
+                    print(f"Dropping reports until connected to {target}")
+                self.dropped_reports += 1
+                return
+            if self.protocol == PROTOCOL_BOOT:
+                msg = to_boot_report(msg)
+            self.last_reports[msg[1]] = msg
+
+        try:
+            self.sending_at = perf_counter()
+            if self.on_send:
+                self.on_send()
+            cinterrupt.send(msg)
+            self.error_stats.add(0)
+        except Exception as e:
+            self.error_stats.add(1)
+            print(f"Couldn't send to {target} due to {e}")
+            with self.lock:
+                if cinterrupt and cinterrupt is self.cinterrupt:
+                    print("Going to disconnect!")
+                    self.disconnect()
+            return
+        finally:
+            self.sending_at = None
+
+        send_time = perf_counter() - started_at
+        self.send_stats.add(send_time)
+        self.link_stats.add(send_time)
+        if event_at:
+            self.total_stats.add(time() - event_at)
+
+    def wake_reader(self):
+        self.waker.send(b"\0")
+
+    def manage_reader(self):
+        while True:
+            try:
+                self.iterate_reader()
+            except Exception as e:
+                print(f"An unexpected error occurred in the reader: {e}")
+                traceback.print_exc()
+                print("Carrying on")
+
+    def iterate_reader(self):
+        with self.lock:
+            channels = [channel for channel in [self.ccontrol, self.cinterrupt] if channel]
+
+        read_list, _, _ = select.select([self.wakee, *channels], [], [])
+        for channel in read_list:
+            if channel is self.wakee:
+                self.wakee.recv(self.MESSAGE_SIZE)
+                continue
+
+            with self.lock:
+                if channel is not self.ccontrol and channel is not self.cinterrupt:
+                    continue
+
+            try:
+                message = channel.recv(self.MESSAGE_SIZE)
+            except OSError as e:
+                print(f"Couldn't read from {self.target} due to {e}")
+                message = b""
+
+            if not message:
+                self.drop_channel(channel)
+            elif channel is self.ccontrol:
+                self.process_control(channel, message)
+            else:
+                self.process_interrupt(message)
+
+    def drop_channel(self, channel):
+        with self.lock:
+            if channel is not self.ccontrol and channel is not self.cinterrupt:
+                return
+        print(f"{self.target} closed a channel")
+        self.disconnect()
+
+    def process_control(self, ccontrol, message):
+        kind = message[0] & TYPE_MASK
+        param = message[0] & PARAM_MASK
+
+        if kind == HID_CONTROL:
+            if param == CONTROL_VIRTUAL_CABLE_UNPLUG:
+                print(f"{self.target} unplugged")
+                self.disconnect()
+            return
+
+        if kind == GET_REPORT:
+            reply = self.get_report(param & REPORT_TYPE_MASK, message[1] if len(message) > 1 else REPORT_ID_BOOT)
+        elif kind == SET_REPORT or kind == DATA:
+            reply = self.set_report(param & REPORT_TYPE_MASK, message)
+        elif kind == GET_PROTOCOL:
+            reply = data(0, [self.protocol])
+        elif kind == SET_PROTOCOL:
+            print(f"{self.target} switched to protocol {param & 1}")
+            self.protocol = param & 1
+            reply = handshake(HANDSHAKE_SUCCESSFUL)
+        elif kind == GET_IDLE:
+            reply = data(0, [self.idle_rate])
+        elif kind == SET_IDLE:
+            self.idle_rate = message[1] if len(message) > 1 else 0
+            reply = handshake(HANDSHAKE_SUCCESSFUL)
+        else:
+            reply = handshake(HANDSHAKE_UNSUPPORTED_REQUEST)
+
+        try:
+            ccontrol.send(reply)
+        except OSError as e:
+            print(f"Couldn't reply to {self.target} due to {e}")
+
+    def get_report(self, report_type, report_id):
+        if report_type == REPORT_TYPE_OUTPUT and report_id == REPORT_ID_BOOT:
+            return data(REPORT_TYPE_OUTPUT, [REPORT_ID_BOOT, self.leds])
+
+        if report_type == REPORT_TYPE_INPUT:
+            with self.lock:
+                report = self.last_reports.get(report_id)
+            if report:
+                return report
+            elif report_id == REPORT_ID_BOOT:
+                return data(REPORT_TYPE_INPUT, [REPORT_ID_BOOT] + [0] * (REPORT_LENGTH - 2))
+
+        return handshake(HANDSHAKE_INVALID_REPORT_ID)
+
+    def set_report(self, report_type, message):
+        leds = parse_leds(message)
+        if report_type != REPORT_TYPE_OUTPUT or leds is None:
+            return handshake(HANDSHAKE_INVALID_REPORT_ID)
+
+        self.update_leds(leds)
+        return handshake(HANDSHAKE_SUCCESSFUL)
+
+    def process_interrupt(self, message):
+        leds = parse_leds(message)
+        if message[0] == DATA | REPORT_TYPE_OUTPUT and leds is not None:
+            self.update_leds(leds)
+
+    def update_leds(self, leds):
+        self.leds = leds
+        if self.on_leds:
+            self.on_leds(leds)
 
     def test(self):
         self.send([0xA1, 1, 0, 0, 30, 0, 0, 0, 0, 0])
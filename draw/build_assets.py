@@ -0,0 +1,17 @@
+import sys
+from PIL import Image
+from sprite_helpers import SHEET_PATH, list_assets, parse_frame_key, pack_image, find_transitions, is_sheet_stale, write_sheet
+
+FORCE_FLAG = "--force"
+
+def build_sheet():
+    frames = { parse_frame_key(path): pack_image(Image.open(path)) for path in list_assets() }
+    transitions = find_transitions(frames)
+    write_sheet(frames, transitions)
+    print(f"Packed {len(frames)} frames and {len(transitions)} transitions into {SHEET_PATH}")
+
+if __name__ == "__main__":
+    if FORCE_FLAG in sys.argv or is_sheet_stale():
+        build_sheet()
+    else:
+        print(f"{SHEET_PATH} is up to date")
@@ -2,17 +2,15 @@ import atexit
 import traceback
 import threading
 import buttonshim
-from time import sleep
 from spawn import spawn
 from bash_helpers import bash_halt, bash_led_on, bash_led_off
 from spawn_stdin import spawn_stdin
 from spawn_socket import spawn_socket
 from line_helpers import parse_line
-from time_helpers import is_past, seconds_from_now
+from time_helpers import is_past, seconds_from_now, wait_until
 from socket_helpers import send_to_socket, SOCKET_CAT, SOCKET_BCTL, SOCKET_BUTTONS, SOCKET_TRANSMITTER
 from evdev import UInput, ecodes
 
-TIMER_INTERVAL = 0.1
 FAST_BLINK_INTERVAL = 0.5
 SLOW_BLINK_INTERVAL = 1
 
@@ -162,10 +160,7 @@ def iterate_pixel():
         elif static_color:
             buttonshim.set_pixel(*static_color)
 
-    if blink_at:
-        sleep(TIMER_INTERVAL)
-    else:
-        pixel_event.wait()
+    wait_until(pixel_event, blink_at)
 
 def turn_pixel_off():
     buttonshim.set_pixel(*COLOR_OFF)
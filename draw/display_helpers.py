@@ -1,7 +1,10 @@
 import os
 import sys
 import math
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont
+from stats_helpers import RollingStats
+from sprite_helpers import IMAGE_SIZE, SHEET_PATH, list_assets, parse_frame_key, pack_image, find_dirty_region, find_changed_region, is_sheet_stale, read_sheet
 
 libdir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "lib")
 assets = os.path.join(os.path.dirname(os.path.realpath(__file__)), "assets")
@@ -10,36 +13,73 @@ sys.path.append(libdir)
 from waveshare_epd import epd2in13_V4
 
 MAX_LINE_LENGTH = 20
+TEXT_CACHE_SIZE = 64
 
 epd = epd2in13_V4.EPD()
 font_32 = ImageFont.truetype(os.path.join(assets, "Sevillana.ttf"), 32)
 display_ready = False
 display_halted = False
+sent_buffer = None
+sent_snapshot = None
+frames = {}
+transitions = {}
+busy_stats = {}
 
-def draw_display(image):
-    if display_halted:
+def draw_display(buffer, snapshot=None):
+    global sent_buffer, sent_snapshot
+
+    if display_halted or buffer == sent_buffer:
         return
 
-    if display_ready:
-        epd.displayPartial(epd.getbuffer(image))
+    if not display_ready:
+        init_display(buffer)
+        return
+
+    if not sent_buffer:
+        epd.displayPartial(buffer)
     else:
-        init_display(image)
+        region = find_region(buffer, snapshot)
+        if region:
+            epd.displayPartialWindow(buffer, *region)
+
+    sent_buffer = buffer
+    sent_snapshot = snapshot
+
+def find_region(buffer, snapshot):
+    if snapshot and sent_snapshot and snapshot[0] == sent_snapshot[0] and snapshot[2:] == sent_snapshot[2:]:
+        transition = (snapshot[0], sent_snapshot[1], snapshot[1])
+        if transition in transitions:
+            region, delta = transitions[transition]
+            return region and find_changed_region(combine(delta, text_layer(snapshot[2], snapshot[3])))
+    return find_dirty_region(sent_buffer, buffer)
+
+def record_busy(kind, duration):
+    if kind not in busy_stats:
+        busy_stats[kind] = RollingStats(f"Busy {kind}")
+    busy_stats[kind].add(duration)
+
+def print_display_stats():
+    for stats in list(busy_stats.values()):
+        print(stats.describe())
 
-def init_display(image):
-    global display_ready
+def init_display(buffer):
+    global display_ready, sent_buffer
 
     if display_halted:
         return
 
     print("Initalizing display")
     display_ready = True
+    sent_buffer = None
+    epd.on_busy = record_busy
     epd.init()
-    epd.displayPartBaseImage(epd.getbuffer(image))
+    epd.displayPartBaseImage(buffer)
 
 def freeze_display():
-    global display_ready
+    global display_ready, sent_buffer
     print("Freezing display")
     display_ready = False
+    sent_buffer = None
     epd.sleep()
 
 def halt_display():
@@ -57,10 +97,43 @@ def halt_display():
 def is_long_text(text):
     return text and len(text) > MAX_LINE_LENGTH
 
-def with_text(asset_path, text, half_screen):
-    path = os.path.join(assets, asset_path)
-    base = Image.new("1", (250, 122), 255)
-    base.paste(Image.open(path), (0, 0))
+def load_frames():
+    if is_sheet_stale() or not load_sheet():
+        print(f"Decoding the assets instead of {SHEET_PATH}")
+        for path in list_assets():
+            frames[parse_frame_key(path)] = pack_image(Image.open(path))
+    print(f"Loaded {len(frames)} frames and {len(transitions)} transitions")
+
+def load_sheet():
+    try:
+        sheet_frames, sheet_transitions = read_sheet()
+    except Exception as e:
+        print(f"Couldn't read {SHEET_PATH} due to {e}")
+        return False
+
+    frames.update(sheet_frames)
+    transitions.update(sheet_transitions)
+    return True
+
+def combine(first, second):
+    return (int.from_bytes(first, "big") & int.from_bytes(second, "big")).to_bytes(len(first), "big")
+
+def with_text(state, frame, text, half_screen):
+    return combine(frames[(state, frame)], text_layer(text, half_screen))
+
+def text_layer(text, half_screen):
+    return render_text(text, half_screen and is_long_text(text))
+
+def warm_texts(texts):
+    for text in texts:
+        render_text(text, False)
+        if is_long_text(text):
+            render_text(text, True)
+    print(f"Rendered {render_text.cache_info().currsize} texts")
+
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def render_text(text, half_screen):
+    base = Image.new("1", IMAGE_SIZE, 255)
     draw = ImageDraw.Draw(base)
 
     if is_long_text(text):
@@ -74,7 +147,7 @@ def with_text(asset_path, text, half_screen):
     else:
         draw.text((0, -4), text, font=font_32, fill=0)
 
-    return base
+    return pack_image(base)
 
 def find_middle(text):
     middle = len(text) // 2
@@ -2,14 +2,12 @@ import atexit
 import random
 import traceback
 import threading
-from time import sleep
-from datetime import datetime
 from list_helpers import wrap_list
 from line_helpers import parse_line
-from time_helpers import seconds_from_now, is_past, is_older_than
+from time_helpers import now, seconds_from_now, is_past, is_older_than, wait_until
 from state_helpers import next_state, CAN, LOW, DEFAULT
 from socket_helpers import SOCKET_CAT
-from display_helpers import draw_display, freeze_display, halt_display, with_text, is_long_text
+from display_helpers import draw_display, freeze_display, halt_display, print_display_stats, load_frames, warm_texts, with_text, is_long_text
 from spawn import spawn
 from spawn_stdin import spawn_stdin
 from spawn_socket import spawn_socket
@@ -45,7 +43,6 @@ WISHES = [
 DEFAULT_TEXT = "You are beautiful"
 
 FRAME_INTERVAL = 0.5
-TIMER_INTERVAL = 0.25
 
 IDLE_DELAY = 180
 FLUSH_DELAY = 20
@@ -62,6 +59,7 @@ STATE_RUN_LEFT = "cat_run_left"
 STATE_SIT_RIGHT = "cat_sit_right"
 STATE_RUN_RIGHT = "cat_run_right"
 STATE_JUMP = "cat_jump"
+STATE_IDLE = "rina"
 
 RUN_STATES = [STATE_RUN_LEFT, STATE_RUN_RIGHT]
 SLEEP_STATES = [STATE_SLEEP_LEFT]
@@ -104,7 +102,7 @@ STATES = {
 
 step_at = None
 clear_at = None
-updated_at = datetime.now()
+updated_at = now()
 
 current_bt = None
 current_ip = None
@@ -113,8 +111,12 @@ current_halt = False
 current_step = 0
 current_state = STATE_CLIMB
 target_states = []
+drawn_frame = None
+pending_frame = None
+pending_lock = threading.Lock()
 
 frame_event = threading.Event()
+display_event = threading.Event()
 timer_event = threading.Event()
 error_event = threading.Event()
 
@@ -152,10 +154,7 @@ def iterate_timer():
         new_step_at(None)
         print(f"Incremented {current_step}")
 
-    if clear_at or step_at:
-        sleep(TIMER_INTERVAL)
-    else:
-        timer_event.wait()
+    wait_until(timer_event, clear_at, step_at)
 
 def manage_frame():
     try:
@@ -174,17 +173,45 @@ def iterate_frame():
     should_idle = not current_text and is_older_than(updated_at, IDLE_DELAY)
 
     if current_halt or (can_idle and should_idle):
-        print("Idling")
-        draw_display(with_text("rina.bmp", text, False))
-        freeze_display()
+        render_frame([STATE_IDLE, None, text, False], True)
     else:
         new_step_at(FRAME_INTERVAL)
         frame = (current_step % STEP_COUNT) + 1
         half_screen = in_one_of(HALF_SCREEN_STATES)
-        draw_display(with_text(f"{current_state}/{frame}.bmp", text, half_screen))
+        render_frame([current_state, frame, text, half_screen], False)
 
     frame_event.wait()
 
+def render_frame(snapshot, idle):
+    if snapshot == drawn_frame:
+        return
+
+    new_drawn_frame(snapshot)
+    new_pending_frame([with_text(*snapshot), snapshot, idle])
+
+def manage_display():
+    try:
+        while True:
+            iterate_display()
+    except Exception as e:
+        print(f"An unexpected error occurred in the display manager: {e}")
+        traceback.print_exc()
+        error_event.set()
+
+def iterate_display():
+    display_event.wait()
+    display_event.clear()
+
+    frame = take_pending_frame()
+    if not frame:
+        return
+
+    buffer, snapshot, idle = frame
+    draw_display(buffer, snapshot)
+    if idle:
+        print("Idling")
+        freeze_display()
+
 def process_line(line):
     if current_halt:
         print(f"Ignoring {line}")
@@ -216,6 +243,8 @@ def process_line(line):
         plan_stat_update(what, value)
     elif what == "BT":
         plan_stat_update(what, value)
+    elif what == "Stats":
+        print_display_stats()
     else:
         plan_flush(line)
 
@@ -307,6 +336,23 @@ def new_target_state(states):
     timer_event.set()
     frame_event.set()
 
+def new_drawn_frame(value):
+    global drawn_frame
+    drawn_frame = value
+
+def new_pending_frame(value):
+    global pending_frame
+    with pending_lock:
+        pending_frame = value
+    display_event.set()
+
+def take_pending_frame():
+    global pending_frame
+    with pending_lock:
+        frame = pending_frame
+        pending_frame = None
+    return frame
+
 def new_step_at(seconds):
     global step_at
     if seconds is None:
@@ -325,7 +371,7 @@ def new_clear_at(seconds):
 
 def touch_updated_at():
     global updated_at
-    updated_at = datetime.now()
+    updated_at = now()
 
 def wipe_reached_state():
     if in_target_state():
@@ -349,8 +395,11 @@ def switch_state():
     current_state = next_state(STATES, current_state, target_states)
 
 atexit.register(halt_display)
+load_frames()
+warm_texts(WISHES + [DEFAULT_TEXT])
 
 frame_thread = spawn(manage_frame)
+display_thread = spawn(manage_display)
 timer_thread = spawn(manage_timer)
 stdin_thread = spawn_stdin(process_line, error_event)
 socket_thread = spawn_socket(SOCKET_CAT, process_line, error_event)
@@ -0,0 +1,301 @@
+import os
+import queue
+import errno
+import select
+import socket
+import threading
+import traceback
+from time import time, sleep, monotonic
+from spawn import spawn
+from btkeyboard import BtKeyboard
+from watch_bt import DEVICE_INTERFACE, DBUS_PROP_IFACE, DBUS_OM_IFACE
+from bt_agent import ADAPTER_INTERFACE
+
+SOCKETS_PATH = "/tmp/fake_bluez"
+MESSAGE_SIZE = 64
+LISTEN_BACKLOG = 8
+ADAPTER_PATH = "/org/bluez/hci0"
+FAKE_RSSI = -50
+SIGNAL_DELAY = 0.005
+
+def channel_path(address, psm):
+    return os.path.join(SOCKETS_PATH, f"{address.replace(':', '_')}_{psm}")
+
+def device_path(address):
+    return f"/org/bluez/hci0/dev_{address.replace(':', '_')}"
+
+class FakeObject:
+    def __init__(self, bluez):
+        self.bluez = bluez
+
+    def get_dbus_method(self, member, dbus_interface=None):
+        return getattr(self.bluez, member)
+
+class FakeBluez:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.devices = {}
+        self.profiles = {}
+        self.receivers = []
+        self.signals = queue.Queue()
+        self.around = set()
+        self.discovery_filter = None
+        os.makedirs(SOCKETS_PATH, exist_ok=True)
+        spawn(self.manage_signals)
+
+    def get_object(self, service, path):
+        return FakeObject(self)
+
+    def channel(self):
+        return FakeChannel(self)
+
+    def add_signal_receiver(self, handler, dbus_interface=None, signal_name=None, arg0=None, path_keyword=None):
+        with self.lock:
+            self.receivers.append([handler, dbus_interface, signal_name, arg0, path_keyword])
+
+    def emit(self, path, dbus_interface, signal_name, *args):
+        self.signals.put([monotonic() + SIGNAL_DELAY, path, dbus_interface, signal_name, args])
+
+    def manage_signals(self):
+        while True:
+            try:
+                self.iterate_signals()
+            except Exception as e:
+                print(f"An unexpected error occurred in the fake signals: {e}")
+                traceback.print_exc()
+
+    def iterate_signals(self):
+        deliver_at, path, dbus_interface, signal_name, args = self.signals.get()
+        sleep(max(0, deliver_at - monotonic()))
+
+        with self.lock:
+            receivers = list(self.receivers)
+
+        for handler, interface, name, arg0, path_keyword in receivers:
+            if interface != dbus_interface or name != signal_name:
+                continue
+            if arg0 is not None and args[0] != arg0:
+                continue
+            if path_keyword:
+                handler(*args, **{ path_keyword: path })
+            else:
+                handler(*args)
+
+    def RegisterProfile(self, path, uuid, options):
+        with self.lock:
+            self.profiles[uuid] = [path, options]
+
+    def GetManagedObjects(self):
+        with self.lock:
+            objects = { path: { DEVICE_INTERFACE: dict(properties) } for path, properties in self.devices.items() }
+        objects[ADAPTER_PATH] = { ADAPTER_INTERFACE: { "Address": "0A:00:00:00:00:00" } }
+        return objects
+
+    def SetDiscoveryFilter(self, discovery_filter):
+        with self.lock:
+            self.discovery_filter = dict(discovery_filter)
+
+    def StartDiscovery(self):
+        with self.lock:
+            if self.discovery_filter is None:
+                self.discovery_filter = {}
+            addresses = [address for address in self.around if self.is_discovered(address)]
+        for address in addresses:
+            self.set_property(address, "RSSI", FAKE_RSSI)
+
+    def StopDiscovery(self):
+        with self.lock:
+            self.discovery_filter = None
+            addresses = list(self.around)
+        for address in addresses:
+            self.clear_property(address, "RSSI")
+
+    def is_discovered(self, address):
+        return self.discovery_filter is not None and address.startswith(self.discovery_filter.get("Pattern", ""))
+
+    def appear(self, address):
+        with self.lock:
+            self.around.add(address)
+            discovered = self.is_discovered(address)
+        if discovered:
+            self.set_property(address, "RSSI", FAKE_RSSI)
+
+    def disappear(self, address):
+        with self.lock:
+            self.around.discard(address)
+        self.clear_property(address, "RSSI")
+
+    def add_device(self, address, alias, paired=True):
+        path = device_path(address)
+        properties = { "Address": address, "Alias": alias, "Paired": paired, "Connected": False }
+        with self.lock:
+            self.devices[path] = properties
+        self.emit(path, DBUS_OM_IFACE, "InterfacesAdded", path, { DEVICE_INTERFACE: dict(properties) })
+
+    def remove_device(self, address):
+        path = device_path(address)
+        with self.lock:
+            self.devices.pop(path, None)
+        self.emit(path, DBUS_OM_IFACE, "InterfacesRemoved", path, [DEVICE_INTERFACE])
+
+    def set_property(self, address, name, value):
+        path = device_path(address)
+        with self.lock:
+            if path not in self.devices or self.devices[path].get(name) == value:
+                return
+            self.devices[path][name] = value
+        self.emit(path, DBUS_PROP_IFACE, "PropertiesChanged", DEVICE_INTERFACE, { name: value }, [])
+
+    def clear_property(self, address, name):
+        path = device_path(address)
+        with self.lock:
+            if path not in self.devices or name not in self.devices[path]:
+                return
+            del self.devices[path][name]
+        self.emit(path, DBUS_PROP_IFACE, "PropertiesChanged", DEVICE_INTERFACE, {}, [name])
+
+class FakeChannel:
+    def __init__(self, bluez):
+        self.bluez = bluez
+        self.channel = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.peer = None
+
+    def connect_ex(self, address):
+        target, psm = address
+        error = self.channel.connect_ex(channel_path(target, psm))
+        if error in [errno.ENOENT, errno.ECONNREFUSED]:
+            return errno.EHOSTDOWN
+        if error in [0, errno.EINPROGRESS, errno.EAGAIN]:
+            self.peer = address
+            self.bluez.set_property(target, "Connected", True)
+        return error
+
+    def getpeername(self):
+        if not self.peer:
+            raise OSError(errno.ENOTCONN, os.strerror(errno.ENOTCONN))
+        self.channel.getpeername()
+        return self.peer
+
+    def fileno(self):
+        return self.channel.fileno()
+
+    def setblocking(self, flag):
+        self.channel.setblocking(flag)
+
+    def getsockopt(self, level, option):
+        return self.channel.getsockopt(level, option)
+
+    def send(self, data):
+        return self.channel.send(data)
+
+    def recv(self, size):
+        return self.channel.recv(size)
+
+    def shutdown(self, how):
+        self.channel.shutdown(how)
+
+    def close(self):
+        self.channel.close()
+
+class FakeHost:
+    def __init__(self, bluez, address, alias):
+        self.bluez = bluez
+        self.address = address
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.channels = []
+        self.reports = []
+        self.report_event = threading.Event()
+        self.connected_event = threading.Event()
+        self.disconnected_event = threading.Event()
+        self.stall_event = threading.Event()
+        bluez.add_device(address, alias)
+
+    def come_around(self):
+        with self.lock:
+            if self.listeners:
+                return
+            for psm in [BtKeyboard.P_CTRL, BtKeyboard.P_INTR]:
+                path = channel_path(self.address, psm)
+                if os.path.exists(path):
+                    os.remove(path)
+                listener = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+                listener.bind(path)
+                listener.listen(LISTEN_BACKLOG)
+                self.listeners.append(listener)
+            ccontrol_listener, cinterrupt_listener = self.listeners
+        spawn(self.manage_host, ccontrol_listener, cinterrupt_listener)
+        self.bluez.appear(self.address)
+
+    def go_away(self):
+        with self.lock:
+            listeners = self.listeners
+            self.listeners = []
+        for listener in listeners:
+            os.remove(listener.getsockname())
+            listener.close()
+        self.bluez.disappear(self.address)
+        self.unplug()
+
+    def unplug(self):
+        with self.lock:
+            self.disconnected_event.clear()
+            for channel in self.channels:
+                channel.shutdown(socket.SHUT_RDWR)
+            self.channels = []
+
+    def stall(self):
+        with self.lock:
+            self.disconnected_event.clear()
+        self.stall_event.set()
+
+    def send_control(self, message):
+        with self.lock:
+            ccontrol = self.channels[0] if self.channels else None
+        if ccontrol:
+            ccontrol.send(bytes(message))
+
+    def manage_host(self, ccontrol_listener, cinterrupt_listener):
+        try:
+            while True:
+                self.iterate_host(ccontrol_listener, cinterrupt_listener)
+        except OSError:
+            pass
+        except Exception as e:
+            print(f"An unexpected error occurred in the fake {self.address}: {e}")
+            traceback.print_exc()
+
+    def iterate_host(self, ccontrol_listener, cinterrupt_listener):
+        ccontrol, _ = ccontrol_listener.accept()
+        cinterrupt, _ = cinterrupt_listener.accept()
+        with self.lock:
+            self.channels = [ccontrol, cinterrupt]
+
+        self.connected_event.set()
+        try:
+            self.receive(ccontrol, cinterrupt)
+        finally:
+            with self.lock:
+                self.channels = []
+            self.connected_event.clear()
+            self.stall_event.clear()
+            self.disconnected_event.set()
+            self.bluez.set_property(self.address, "Connected", False)
+            ccontrol.close()
+            cinterrupt.close()
+
+    def receive(self, ccontrol, cinterrupt):
+        while True:
+            channels = [ccontrol] if self.stall_event.is_set() else [ccontrol, cinterrupt]
+            read_list, _, _ = select.select(channels, [], [])
+            for channel in read_list:
+                try:
+                    message = channel.recv(MESSAGE_SIZE)
+                except OSError:
+                    message = b""
+
+                if not message:
+                    return
+                elif channel is cinterrupt:
+                    self.reports.append([time(), message])
+                    self.report_event.set()
@@ -0,0 +1,11 @@
+import struct
+from time import time
+
+FRAME_HEADER = struct.Struct("<dd")
+
+def pack_frame(report, event_at):
+    return FRAME_HEADER.pack(event_at, time()) + report
+
+def unpack_frame(frame):
+    event_at, sent_at = FRAME_HEADER.unpack_from(frame)
+    return [event_at, sent_at, frame[FRAME_HEADER.size:]]
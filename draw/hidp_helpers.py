@@ -0,0 +1,60 @@
+TARGET_LENGTH = 6
+MODS_OFFSET = 2
+KEYS_OFFSET = 4
+REPORT_LENGTH = KEYS_OFFSET + TARGET_LENGTH
+
+REPORT_ID_BOOT = 0x01
+REPORT_ID_NKRO = 0x04
+BITMAP_OFFSET = 3
+NKRO_LENGTH = BITMAP_OFFSET + 256 // 8
+
+HANDSHAKE = 0x00
+HID_CONTROL = 0x10
+GET_REPORT = 0x40
+SET_REPORT = 0x50
+GET_PROTOCOL = 0x60
+SET_PROTOCOL = 0x70
+GET_IDLE = 0x80
+SET_IDLE = 0x90
+DATA = 0xA0
+
+TYPE_MASK = 0xF0
+PARAM_MASK = 0x0F
+REPORT_TYPE_MASK = 0x03
+
+HANDSHAKE_SUCCESSFUL = 0x00
+HANDSHAKE_INVALID_REPORT_ID = 0x02
+HANDSHAKE_UNSUPPORTED_REQUEST = 0x03
+
+CONTROL_VIRTUAL_CABLE_UNPLUG = 0x05
+
+REPORT_TYPE_INPUT = 0x01
+REPORT_TYPE_OUTPUT = 0x02
+
+PROTOCOL_BOOT = 0x00
+PROTOCOL_REPORT = 0x01
+
+ROLLOVER_USAGE = 0x01
+
+def handshake(result):
+    return bytes([HANDSHAKE | result])
+
+def data(report_type, payload):
+    return bytes([DATA | report_type, *payload])
+
+def to_boot_report(report):
+    if report[1] != REPORT_ID_NKRO:
+        return report
+
+    usages = [usage for usage in range(256) if report[BITMAP_OFFSET + (usage >> 3)] & (1 << (usage & 7))]
+    if len(usages) > TARGET_LENGTH:
+        usages = [ROLLOVER_USAGE] * TARGET_LENGTH
+    else:
+        usages += [0] * (TARGET_LENGTH - len(usages))
+    return bytes([DATA | REPORT_TYPE_INPUT, REPORT_ID_BOOT, report[MODS_OFFSET], 0, *usages])
+
+def parse_leds(message):
+    if len(message) >= 3 and message[1] == REPORT_ID_BOOT:
+        return message[2]
+    elif len(message) == 2:
+        return message[1]
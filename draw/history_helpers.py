@@ -0,0 +1,58 @@
+import os
+import json
+from time import time
+
+ROOT_PATH = os.path.dirname(os.path.realpath(__file__))
+HISTORY_PATH = os.path.join(ROOT_PATH, "../.host_history")
+
+LATENCY_WEIGHT = 0.3
+DAY_SECONDS = 24 * 60 * 60
+
+def read_history():
+    try:
+        with open(HISTORY_PATH, "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        print(f"Ignoring {HISTORY_PATH} due to {e}")
+        return {}
+
+def write_history(history):
+    temp_path = f"{HISTORY_PATH}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(history, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, HISTORY_PATH)
+
+def record_attempt(history, address, connected, latency):
+    entry = history.setdefault(address, { "attempts": 0, "successes": 0, "connected_at": None, "latency": None })
+    entry["attempts"] += 1
+    if connected:
+        entry["successes"] += 1
+        entry["connected_at"] = time()
+        if entry["latency"] is None:
+            entry["latency"] = latency
+        else:
+            entry["latency"] += LATENCY_WEIGHT * (latency - entry["latency"])
+
+    try:
+        write_history(history)
+    except Exception as e:
+        print(f"Couldn't write {HISTORY_PATH} due to {e}")
+
+def rank_addresses(history, addresses):
+    return sorted(addresses, key=lambda address: rank_key(history.get(address)))
+
+def best_address(history):
+    ranked = rank_addresses(history, [address for address, entry in history.items() if entry["connected_at"]])
+    return ranked[0] if ranked else None
+
+def rank_key(entry):
+    if not entry or not entry["connected_at"]:
+        return [0, 0]
+
+    success_rate = (entry["successes"] + 1) / (entry["attempts"] + 2)
+    age_days = max(0, time() - entry["connected_at"]) / DAY_SECONDS
+    return [-success_rate / (1 + age_days), entry["latency"]]
@@ -1,197 +1,32 @@
-import json
+import sys
 import evdev
 import pyudev
 import traceback
 import threading
 from spawn import spawn
-from select import select
+from select import epoll, EPOLLIN, EPOLLERR, EPOLLHUP
 from list_helpers import difference
-from socket_helpers import send_to_socket, SOCKET_CAT, SOCKET_TRANSMITTER
+from line_helpers import parse_line
+from spawn_socket import spawn_socket
+from hid_helpers import BootReport, NkroReport
+from frame_helpers import pack_frame
+from socket_helpers import send_to_socket, PacketSender, SOCKET_CAT, SOCKET_RELAY, SOCKET_REPORTS
 
-TARGET_LENGTH = 6
+NKRO_FLAG = "--nkro"
+LEDS = [evdev.ecodes.LED_NUML, evdev.ecodes.LED_CAPSL, evdev.ecodes.LED_SCROLLL, evdev.ecodes.LED_COMPOSE, evdev.ecodes.LED_KANA]
 
-KEYTABLE = {
-    "KEY_RESERVED": 0,
-    "KEY_ESC": 41,
-    "KEY_1": 30,
-    "KEY_2": 31,
-    "KEY_3": 32,
-    "KEY_4": 33,
-    "KEY_5": 34,
-    "KEY_6": 35,
-    "KEY_7": 36,
-    "KEY_8": 37,
-    "KEY_9": 38,
-    "KEY_0": 39,
-    "KEY_MINUS": 45,
-    "KEY_EQUAL": 46,
-    "KEY_BACKSPACE": 42,
-    "KEY_TAB": 43,
-    "KEY_Q": 20,
-    "KEY_W": 26,
-    "KEY_E": 8,
-    "KEY_R": 21,
-    "KEY_T": 23,
-    "KEY_Y": 28,
-    "KEY_U": 24,
-    "KEY_I": 12,
-    "KEY_O": 18,
-    "KEY_P": 19,
-    "KEY_LEFTBRACE": 47,
-    "KEY_RIGHTBRACE": 48,
-    "KEY_ENTER": 40,
-    "KEY_LEFTCTRL": 224,
-    "KEY_A": 4,
-    "KEY_S": 22,
-    "KEY_D": 7,
-    "KEY_F": 9,
-    "KEY_G": 10,
-    "KEY_H": 11,
-    "KEY_J": 13,
-    "KEY_K": 14,
-    "KEY_L": 15,
-    "KEY_SEMICOLON": 51,
-    "KEY_APOSTROPHE": 52,
-    "KEY_GRAVE": 53,
-    "KEY_LEFTSHIFT": 225,
-    "KEY_BACKSLASH": 50,
-    "KEY_Z": 29,
-    "KEY_X": 27,
-    "KEY_C": 6,
-    "KEY_V": 25,
-    "KEY_B": 5,
-    "KEY_N": 17,
-    "KEY_M": 16,
-    "KEY_COMMA": 54,
-    "KEY_DOT": 55,
-    "KEY_SLASH": 56,
-    "KEY_RIGHTSHIFT": 229,
-    "KEY_KPASTERISK": 85,
-    "KEY_LEFTALT": 226,
-    "KEY_SPACE": 44,
-    "KEY_CAPSLOCK": 57,
-    "KEY_F1": 58,
-    "KEY_F2": 59,
-    "KEY_F3": 60,
-    "KEY_F4": 61,
-    "KEY_F5": 62,
-    "KEY_F6": 63,
-    "KEY_F7": 64,
-    "KEY_F8": 65,
-    "KEY_F9": 66,
-    "KEY_F10": 67,
-    "KEY_NUMLOCK": 83,
-    "KEY_SCROLLLOCK": 71,
-    "KEY_KP7": 95,
-    "KEY_KP8": 96,
-    "KEY_KP9": 97,
-    "KEY_KPMINUS": 86,
-    "KEY_KP4": 92,
-    "KEY_KP5": 93,
-    "KEY_KP6": 94,
-    "KEY_KPPLUS": 87,
-    "KEY_KP1": 89,
-    "KEY_KP2": 90,
-    "KEY_KP3": 91,
-    "KEY_KP0": 98,
-    "KEY_KPDOT": 99,
-    "KEY_ZENKAKUHANKAKU": 148,
-    "KEY_102ND": 100,
-    "KEY_F11": 68,
-    "KEY_F12": 69,
-    "KEY_RO": 135,
-    "KEY_KATAKANA": 146,
-    "KEY_HIRAGANA": 147,
-    "KEY_HENKAN": 138,
-    "KEY_KATAKANAHIRAGANA": 136,
-    "KEY_MUHENKAN": 139,
-    "KEY_KPJPCOMMA": 140,
-    "KEY_KPENTER": 88,
-    "KEY_RIGHTCTRL": 228,
-    "KEY_KPSLASH": 84,
-    "KEY_SYSRQ": 70,
-    "KEY_RIGHTALT": 230,
-    "KEY_HOME": 74,
-    "KEY_UP": 82,
-    "KEY_PAGEUP": 75,
-    "KEY_LEFT": 80,
-    "KEY_RIGHT": 79,
-    "KEY_END": 77,
-    "KEY_DOWN": 81,
-    "KEY_PAGEDOWN": 78,
-    "KEY_INSERT": 73,
-    "KEY_DELETE": 76,
-    "KEY_MUTE": 239,
-    "KEY_VOLUMEDOWN": 238,
-    "KEY_VOLUMEUP": 237,
-    "KEY_POWER": 102,
-    "KEY_KPEQUAL": 103,
-    "KEY_PAUSE": 72,
-    "KEY_KPCOMMA": 133,
-    "KEY_HANGEUL": 144,
-    "KEY_HANJA": 145,
-    "KEY_YEN": 137,
-    "KEY_LEFTMETA": 227,
-    "KEY_RIGHTMETA": 231,
-    "KEY_COMPOSE": 101,
-    "KEY_STOP": 243,
-    "KEY_AGAIN": 121,
-    "KEY_PROPS": 118,
-    "KEY_UNDO": 122,
-    "KEY_FRONT": 119,
-    "KEY_COPY": 124,
-    "KEY_OPEN": 116,
-    "KEY_PASTE": 125,
-    "KEY_FIND": 244,
-    "KEY_CUT": 123,
-    "KEY_HELP": 117,
-    "KEY_CALC": 251,
-    "KEY_SLEEP": 248,
-    "KEY_WWW": 240,
-    "KEY_COFFEE": 249,
-    "KEY_BACK": 241,
-    "KEY_FORWARD": 242,
-    "KEY_EJECTCD": 236,
-    "KEY_NEXTSONG": 235,
-    "KEY_PLAYPAUSE": 232,
-    "KEY_PREVIOUSSONG": 234,
-    "KEY_STOPCD": 233,
-    "KEY_REFRESH": 250,
-    "KEY_EDIT": 247,
-    "KEY_SCROLLUP": 245,
-    "KEY_SCROLLDOWN": 246,
-    "KEY_F13": 104,
-    "KEY_F14": 105,
-    "KEY_F15": 106,
-    "KEY_F16": 107,
-    "KEY_F17": 108,
-    "KEY_F18": 109,
-    "KEY_F19": 110,
-    "KEY_F20": 111,
-    "KEY_F21": 112,
-    "KEY_F22": 113,
-    "KEY_F23": 114,
-    "KEY_F24": 115
-}
+keys = NkroReport() if NKRO_FLAG in sys.argv else BootReport()
+sent_report = bytes(keys.report)
 
-MODKEYS = {
-    "KEY_RIGHTMETA": 0,
-    "KEY_RIGHTALT": 1,
-    "KEY_RIGHTSHIFT": 2,
-    "KEY_RIGHTCTRL": 3,
-    "KEY_LEFTMETA": 4,
-    "KEY_LEFTALT": 5,
-    "KEY_LEFTSHIFT": 6,
-    "KEY_LEFTCTRL": 7
-}
-
-mod_keys = 0b00000000
-pressed_keys = []
+current_leds = 0
 
 devices = []
+devices_by_fd = {}
+input_poll = epoll()
 error_event = threading.Event()
 device_event = threading.Event()
 device_observer = None
+report_sink = None
 
 def manage_inputs():
     while True:
@@ -203,59 +38,25 @@ def manage_inputs():
             print("Carrying on")
 
 def iterate_inputs():
-    read_list, _, _ = select(devices, [], [], 0.01)
-    for file_descriptor in read_list:
-        for event in file_descriptor.read():
-            if event.type == evdev.ecodes.EV_KEY and event.value <= 1:
-                key_str = evdev.ecodes.KEY[event.code]
-                mod_key = to_mod_key(key_str)
-                ord_key = to_ord_key(key_str)
-
-                if mod_key != -1:
-                    update_mod_keys(mod_key, event.value)
-                elif ord_key != -1:
-                    update_ord_keys(ord_key, event.value)
-
-                send_keys()
-
-def to_mod_key(key_str):
-    if key_str in MODKEYS:
-        return MODKEYS[key_str]
-    else:
-        return -1
-
-def to_ord_key(key_str):
-    if key_str in KEYTABLE:
-        return KEYTABLE[key_str]
-    else:
-        return -1
-
-def update_mod_keys(mod_key, value):
-    global mod_keys
-    bit_mask = 1 << (7 - mod_key)
-    if value:
-        mod_keys |= bit_mask
-    else:
-        mod_keys &= ~bit_mask
-
-def update_ord_keys(ord_key, value):
-    global pressed_keys
-    if value == 0:
-        pressed_keys.remove(ord_key)
-    elif ord_key not in pressed_keys:
-        pressed_keys.insert(0, ord_key)
-
-    len_delta = TARGET_LENGTH - len(pressed_keys)
-    if len_delta < 0:
-        pressed_keys = pressed_keys[:len_delta]
-    elif len_delta > 0:
-        pressed_keys.extend([0] * len_delta)
-
-def send_keys():
-    send_to_socket(SOCKET_TRANSMITTER, f"Send: {json.dumps(encode_keys())}")
-
-def encode_keys():
-    return [0xA1, 0x01, mod_keys, 0, *pressed_keys]
+    for file_descriptor, mask in input_poll.poll():
+        device = devices_by_fd.get(file_descriptor)
+        if mask & (EPOLLERR | EPOLLHUP):
+            forget_device(file_descriptor)
+        elif device:
+            process_events(device.read())
+
+def process_events(events):
+    for event in events:
+        if event.type == evdev.ecodes.EV_KEY and event.value <= 1:
+            keys.update(event.code, event.value)
+        elif event.type == evdev.ecodes.EV_SYN and event.code == evdev.ecodes.SYN_REPORT:
+            flush_keys(event.timestamp())
+
+def flush_keys(event_at):
+    global sent_report
+    if keys.report != sent_report:
+        sent_report = bytes(keys.report)
+        report_sink(pack_frame(sent_report, event_at))
 
 def manage_devices():
     try:
@@ -272,11 +73,15 @@ def iterate_devices():
     cur_devices = get_keyboard_devices()
     new_devices = difference(cur_devices, devices)
     del_devices = difference(devices, cur_devices)
+    for device in difference(cur_devices, new_devices):
+        device.close()
     if new_devices or del_devices:
         for device in new_devices:
             device.grab()
+            watch_device(device)
             print(f"Grabbed keyboard {device.name} at path {device.path}")
         for device in del_devices:
+            forget_device(device.fd)
             device.close()
             print(f"Lost keyboard {device.name} at path {device.path}")
 
@@ -287,9 +92,42 @@ def iterate_devices():
         else:
             send_to_socket(SOCKET_CAT, "Lost a toy")
 
-        devices = cur_devices
+        devices = difference(devices, del_devices) + new_devices
     device_event.wait()
 
+def watch_device(device):
+    devices_by_fd[device.fd] = device
+    input_poll.register(device.fd, EPOLLIN)
+    apply_leds(device)
+
+def forget_device(file_descriptor):
+    if devices_by_fd.pop(file_descriptor, None):
+        try:
+            input_poll.unregister(file_descriptor)
+        except OSError as e:
+            print(f"Couldn't stop watching {file_descriptor} due to {e}")
+
+def process_line(line):
+    print(f"Processing {line}")
+    what, value = parse_line(line)
+    if what == "Leds":
+        new_leds(int(value))
+    else:
+        print(f"Unknown {line}")
+
+def new_leds(value):
+    global current_leds
+    current_leds = value
+    for device in list(devices_by_fd.values()):
+        apply_leds(device)
+
+def apply_leds(device):
+    try:
+        for index, led in enumerate(LEDS):
+            device.set_led(led, (current_leds >> index) & 1)
+    except Exception as e:
+        print(f"Couldn't set LEDs of {device.name} due to {e}")
+
 def get_keyboard_devices():
     keyboards = []
     for device in get_input_devices():
@@ -326,10 +164,16 @@ def create_device_observer(callback):
     device_monitor.filter_by(subsystem="usb")
     return pyudev.MonitorObserver(device_monitor, callback)
 
-input_thread = spawn(manage_inputs)
-device_thread = spawn(manage_devices)
-device_observer = create_device_observer(on_device_change)
-device_observer.start()
-
-error_event.wait()
-print("An error occured. Exiting!")
+def start_relay(sink):
+    global report_sink, device_observer
+    report_sink = sink
+    spawn(manage_inputs)
+    spawn(manage_devices)
+    spawn_socket(SOCKET_RELAY, process_line, error_event)
+    device_observer = create_device_observer(on_device_change)
+    device_observer.start()
+
+if __name__ == "__main__":
+    start_relay(PacketSender(SOCKET_REPORTS).send)
+    error_event.wait()
+    print("An error occured. Exiting!")
@@ -28,6 +28,7 @@
 #
 
 
+import time
 import logging
 from . import epdconfig
 
@@ -35,8 +36,30 @@ from . import epdconfig
 EPD_WIDTH       = 122
 EPD_HEIGHT      = 250
 
+# Longest a full refresh is expected to keep the panel busy, in seconds
+BUSY_TIMEOUT    = 10
+
 logger = logging.getLogger(__name__)
 
+'''
+function : Compile (command, data) steps into a sequence for send_sequence
+parameter:
+    steps : (command, data bytes) pairs
+'''
+def compile_sequence(*steps):
+    return tuple((command, bytes(data)) for command, data in steps)
+
+PARTIAL_SEQUENCE = compile_sequence(
+    (0x3C, [0x80]),             # BorderWavefrom
+    (0x01, [0xF9, 0x00, 0x00]), # Driver output control
+    (0x11, [0x03]),             # data entry mode
+)
+
+TURN_ON_PART_SEQUENCE = compile_sequence(
+    (0x22, [0xFF]), # Display Update Control
+    (0x20, []),     # Activate Display Update Sequence
+)
+
 class EPD:
     def __init__(self):
         self.reset_pin = epdconfig.RST_PIN
@@ -45,6 +68,7 @@ class EPD:
         self.cs_pin = epdconfig.CS_PIN
         self.width = EPD_WIDTH
         self.height = EPD_HEIGHT
+        self.on_busy = None
         
     '''
     function :Hardware reset
@@ -86,16 +110,35 @@ class EPD:
         epdconfig.digital_write(self.cs_pin, 0)
         epdconfig.spi_writebyte2(data)
         epdconfig.digital_write(self.cs_pin, 1)
+
+    '''
+    function :send a compiled sequence in one transaction, data of every command in one write
+    parameter:
+     sequence : Result of compile_sequence
+    '''
+    def send_sequence(self, sequence):
+        epdconfig.digital_write(self.cs_pin, 0)
+        for command, data in sequence:
+            epdconfig.digital_write(self.dc_pin, 0)
+            epdconfig.spi_writebyte([command])
+            if data:
+                epdconfig.digital_write(self.dc_pin, 1)
+                epdconfig.spi_writebyte2(data)
+        epdconfig.digital_write(self.cs_pin, 1)
     
     '''
     function :Wait until the busy_pin goes LOW
     parameter:
+     kind : What the panel is busy with, passed to on_busy with the busy duration
     '''
-    def ReadBusy(self):
+    def ReadBusy(self, kind="busy"):
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 1):      # 0: idle, 1: busy
-            epdconfig.delay_ms(10)  
+        started_at = time.monotonic()
+        if not epdconfig.wait_for_idle(self.busy_pin, BUSY_TIMEOUT):      # 0: idle, 1: busy
+            raise RuntimeError("e-Paper is still busy after %ds" % BUSY_TIMEOUT)
         logger.debug("e-Paper busy release")
+        if self.on_busy:
+            self.on_busy(kind, time.monotonic() - started_at)
 
     '''
     function : Turn On Display
@@ -105,7 +148,7 @@ class EPD:
         self.send_command(0x22) # Display Update Control
         self.send_data(0xf7)
         self.send_command(0x20) # Activate Display Update Sequence
-        self.ReadBusy()
+        self.ReadBusy("full")
 
     '''
     function : Turn On Display Fast
@@ -115,17 +158,15 @@ class EPD:
         self.send_command(0x22) # Display Update Control
         self.send_data(0xC7)    # fast:0x0c, quality:0x0f, 0xcf
         self.send_command(0x20) # Activate Display Update Sequence
-        self.ReadBusy()
+        self.ReadBusy("fast")
     
     '''
     function : Turn On Display Part
     parameter:
     '''
     def TurnOnDisplayPart(self):
-        self.send_command(0x22) # Display Update Control
-        self.send_data(0xff)    # fast:0x0c, quality:0x0f, 0xcf
-        self.send_command(0x20) # Activate Display Update Sequence
-        self.ReadBusy()
+        self.send_sequence(TURN_ON_PART_SEQUENCE)
+        self.ReadBusy("partial")
 
 
     '''
@@ -137,16 +178,16 @@ class EPD:
         yend : End position of Y-axis
     '''
     def SetWindow(self, x_start, y_start, x_end, y_end):
-        self.send_command(0x44) # SET_RAM_X_ADDRESS_START_END_POSITION
-        # x point must be the multiple of 8 or the last 3 bits will be ignored
-        self.send_data((x_start>>3) & 0xFF)
-        self.send_data((x_end>>3) & 0xFF)
-        
-        self.send_command(0x45) # SET_RAM_Y_ADDRESS_START_END_POSITION
-        self.send_data(y_start & 0xFF)
-        self.send_data((y_start >> 8) & 0xFF)
-        self.send_data(y_end & 0xFF)
-        self.send_data((y_end >> 8) & 0xFF)
+        self.send_sequence(self.window_sequence(x_start, y_start, x_end, y_end))
+
+    def window_sequence(self, x_start, y_start, x_end, y_end):
+        return compile_sequence(
+            # SET_RAM_X_ADDRESS_START_END_POSITION
+            # x point must be the multiple of 8 or the last 3 bits will be ignored
+            (0x44, [(x_start>>3) & 0xFF, (x_end>>3) & 0xFF]),
+            # SET_RAM_Y_ADDRESS_START_END_POSITION
+            (0x45, [y_start & 0xFF, (y_start >> 8) & 0xFF, y_end & 0xFF, (y_end >> 8) & 0xFF]),
+        )
 
     '''
     function : Set Cursor
@@ -155,13 +196,16 @@ class EPD:
         y : Y-axis starting position
     '''
     def SetCursor(self, x, y):
-        self.send_command(0x4E) # SET_RAM_X_ADDRESS_COUNTER
-        # x point must be the multiple of 8 or the last 3 bits will be ignored
-        self.send_data(x & 0xFF)
-        
-        self.send_command(0x4F) # SET_RAM_Y_ADDRESS_COUNTER
-        self.send_data(y & 0xFF)
-        self.send_data((y >> 8) & 0xFF)
+        self.send_sequence(self.cursor_sequence(x, y))
+
+    def cursor_sequence(self, x, y):
+        return compile_sequence(
+            # SET_RAM_X_ADDRESS_COUNTER
+            # x point must be the multiple of 8 or the last 3 bits will be ignored
+            (0x4E, [x & 0xFF]),
+            # SET_RAM_Y_ADDRESS_COUNTER
+            (0x4F, [y & 0xFF, (y >> 8) & 0xFF]),
+        )
     
     '''
     function : Initialize the e-Paper register
@@ -173,9 +217,9 @@ class EPD:
         # EPD hardware init start
         self.reset()
         
-        self.ReadBusy()
+        self.ReadBusy("init")
         self.send_command(0x12)  #SWRESET
-        self.ReadBusy() 
+        self.ReadBusy("init") 
 
         self.send_command(0x01) #Driver output control      
         self.send_data(0xf9)
@@ -198,7 +242,7 @@ class EPD:
         self.send_command(0x18)
         self.send_data(0x80)
         
-        self.ReadBusy()
+        self.ReadBusy("init")
         
         return 0
 
@@ -213,7 +257,7 @@ class EPD:
         self.reset()
 
         self.send_command(0x12)  #SWRESET
-        self.ReadBusy() 
+        self.ReadBusy("init") 
 
         self.send_command(0x18) # Read built-in temperature sensor
         self.send_command(0x80)
@@ -227,7 +271,7 @@ class EPD:
         self.send_command(0x22) # Load temperature value
         self.send_data(0xB1)	
         self.send_command(0x20)
-        self.ReadBusy()
+        self.ReadBusy("init")
 
         self.send_command(0x1A) # Write to temperature register
         self.send_data(0x64)
@@ -236,7 +280,7 @@ class EPD:
         self.send_command(0x22) # Load temperature value
         self.send_data(0x91)	
         self.send_command(0x20)
-        self.ReadBusy()
+        self.ReadBusy("init")
         
         return 0
     '''
@@ -289,23 +333,35 @@ class EPD:
         epdconfig.delay_ms(1)
         epdconfig.digital_write(self.reset_pin, 1)  
 
-        self.send_command(0x3C) # BorderWavefrom
-        self.send_data(0x80)
+        self.send_sequence(
+            PARTIAL_SEQUENCE +
+            self.window_sequence(0, 0, self.width - 1, self.height - 1) +
+            self.cursor_sequence(0, 0) +
+            compile_sequence((0x24, image)) + # WRITE_RAM
+            TURN_ON_PART_SEQUENCE
+        )
+        self.ReadBusy("partial")
 
-        self.send_command(0x01) # Driver output control      
-        self.send_data(0xF9) 
-        self.send_data(0x00)
-        self.send_data(0x00)
-
-        self.send_command(0x11) # data entry mode       
-        self.send_data(0x03)
+    '''
+    function : Sends a window of the image buffer in RAM to e-Paper and partial refresh
+    parameter:
+        image : Image data
+        x_start : First byte of the window in a row
+        y_start : First row of the window
+        x_end : Last byte of the window in a row
+        y_end : Last row of the window
+    '''
+    def displayPartialWindow(self, image, x_start, y_start, x_end, y_end):
+        linewidth = (self.width + 7) // 8
+        window = b"".join(image[y * linewidth + x_start:y * linewidth + x_end + 1] for y in range(y_start, y_end + 1))
 
-        self.SetWindow(0, 0, self.width - 1, self.height - 1)
-        self.SetCursor(0, 0)
-        
-        self.send_command(0x24) # WRITE_RAM
-        self.send_data2(image)  
-        self.TurnOnDisplayPart()
+        self.send_sequence(
+            self.window_sequence(x_start * 8, y_start, x_end * 8 + 7, y_end) +
+            self.cursor_sequence(x_start, y_start) +
+            compile_sequence((0x24, window)) + # WRITE_RAM
+            TURN_ON_PART_SEQUENCE
+        )
+        self.ReadBusy("window")
 
     '''
     function : Refresh a base image
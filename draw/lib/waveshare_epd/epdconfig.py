@@ -37,6 +37,18 @@ from ctypes import *
 
 logger = logging.getLogger(__name__)
 
+# How long BUSY may take to rise after a command before we treat it as already done
+BUSY_RISE_TIMEOUT = 0.005
+
+# Fallback for boards without edge-triggered waits
+def poll_for_idle(implementation, pin, timeout):
+    deadline = time.monotonic() + timeout
+    while implementation.digital_read(pin) == 1:
+        if time.monotonic() > deadline:
+            return False
+        implementation.delay_ms(10)
+    return True
+
 
 class RaspberryPi:
     # Pin definition
@@ -98,6 +110,23 @@ class RaspberryPi:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def wait_for_idle(self, pin, timeout):
+        if pin != self.BUSY_PIN:
+            return poll_for_idle(self, pin, timeout)
+
+        # gpiozero's events are only updated from its edge callback thread, so right after
+        # a command the inactive event may still be set from the previous idle period.
+        # Wait for the rising edge first and trust the level over the event.
+        deadline = time.monotonic() + timeout
+        self.GPIO_BUSY_PIN.wait_for_active(BUSY_RISE_TIMEOUT)
+        while self.GPIO_BUSY_PIN.value:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if self.GPIO_BUSY_PIN.wait_for_inactive(remaining) and self.GPIO_BUSY_PIN.value:
+                self.delay_ms(1)
+        return True
+
     def spi_writebyte(self, data):
         self.SPI.writebytes(data)
 
@@ -201,6 +230,9 @@ class JetsonNano:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def wait_for_idle(self, pin, timeout):
+        return poll_for_idle(self, pin, timeout)
+
     def spi_writebyte(self, data):
         self.SPI.SYSFS_software_spi_transfer(data[0])
 
@@ -259,6 +291,9 @@ class SunriseX3:
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
+    def wait_for_idle(self, pin, timeout):
+        return poll_for_idle(self, pin, timeout)
+
     def spi_writebyte(self, data):
         self.SPI.writebytes(data)
 
@@ -0,0 +1,13 @@
+import transmitter
+import input_relay
+from spawn import spawn
+
+def manage_relay_error():
+    input_relay.error_event.wait()
+    transmitter.error_event.set()
+
+watch_loop = transmitter.start_transmitter(input_relay.new_leds)
+input_relay.start_relay(transmitter.process_packet)
+relay_error_thread = spawn(manage_relay_error)
+
+watch_loop.run()
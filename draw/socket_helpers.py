@@ -3,6 +3,8 @@ import socket
 SOCKET_CAT = "/tmp/cat_socket"
 SOCKET_BCTL = "/tmp/bctl_socket"
 SOCKET_BUTTONS = "/tmp/buttons_socket"
+SOCKET_RELAY = "/tmp/relay_socket"
+SOCKET_REPORTS = "/tmp/reports_socket"
 SOCKET_TRANSMITTER = "/tmp/transmitter_socket"
 
 def send_to_socket(socket_path, message):
@@ -13,3 +15,38 @@ def send_to_socket(socket_path, message):
         client_socket.close()
     except Exception as e:
         print(f"Couldn't send {message} to {socket_path} due to {e}")
+
+class PacketSender:
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self.client_socket = None
+
+    def connect(self):
+        self.close()
+        self.client_socket = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.client_socket.connect(self.socket_path)
+
+    def close(self):
+        if self.client_socket:
+            try:
+                self.client_socket.close()
+            except Exception as e:
+                print(f"Couldn't close {self.socket_path} due to {e}")
+            finally:
+                self.client_socket = None
+
+    def send(self, packet):
+        try:
+            if not self.client_socket:
+                self.connect()
+            self.client_socket.send(packet)
+        except Exception:
+            self.resend(packet)
+
+    def resend(self, packet):
+        try:
+            self.connect()
+            self.client_socket.send(packet)
+        except Exception as e:
+            print(f"Couldn't send {bytes(packet).hex()} to {self.socket_path} due to {e}")
+            self.close()
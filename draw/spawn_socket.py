@@ -4,11 +4,13 @@ import traceback
 from spawn import spawn
 from line_helpers import process_lines
 
-def create_socket(socket_path):
+PACKET_SIZE = 1024
+
+def create_socket(socket_path, socket_type=socket.SOCK_STREAM):
     if os.path.exists(socket_path):
         os.remove(socket_path)
 
-    server_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server_sock = socket.socket(socket.AF_UNIX, socket_type)
     server_sock.bind(socket_path)
     server_sock.listen(1)
     return server_sock
@@ -41,3 +43,31 @@ def listen_to_socket(socket_path, process_line, error_event):
 
 def spawn_socket(socket_path, process_line, error_event):
     return spawn(listen_to_socket, socket_path, process_line, error_event)
+
+def listen_to_packet_connection(connection, process_packet, error_event):
+    try:
+        while True:
+            packet = connection.recv(PACKET_SIZE)
+            if packet:
+                process_packet(packet)
+            else:
+                connection.close()
+                break
+    except Exception as e:
+        print(f"An unexpected error occurred in the packet connection listener: {e}")
+        traceback.print_exc()
+        error_event.set()
+
+def listen_to_packets(socket_path, process_packet, error_event):
+    try:
+        server = create_socket(socket_path, socket.SOCK_SEQPACKET)
+        while True:
+            connection, _ = server.accept()
+            spawn(listen_to_packet_connection, connection, process_packet, error_event)
+    except Exception as e:
+        print(f"An unexpected error occurred in the packet server thread: {e}")
+        traceback.print_exc()
+        error_event.set()
+
+def spawn_packets(socket_path, process_packet, error_event):
+    return spawn(listen_to_packets, socket_path, process_packet, error_event)
@@ -0,0 +1,129 @@
+import os
+import glob
+import mmap
+import struct
+from PIL import Image
+
+ROOT_PATH = os.path.dirname(os.path.realpath(__file__))
+ASSETS_PATH = os.path.join(ROOT_PATH, "assets")
+SHEET_PATH = os.path.join(ASSETS_PATH, "frames.bin")
+
+IMAGE_SIZE = (250, 122)
+ROW_BYTES = (IMAGE_SIZE[1] + 7) // 8
+
+SHEET_MAGIC = b"MRTN"
+SHEET_VERSION = 2
+HEADER = struct.Struct("<4sHHHH")
+FRAME_ENTRY = struct.Struct("<32sBI")
+TRANSITION_ENTRY = struct.Struct("<32sBBBBBHHI")
+NO_FRAME = 0
+
+def list_assets():
+    return sorted(glob.glob(os.path.join(ASSETS_PATH, "**", "*.bmp"), recursive=True))
+
+def parse_frame_key(path):
+    name, _ = os.path.splitext(os.path.relpath(path, ASSETS_PATH))
+    state, _, frame = name.rpartition(os.sep)
+    return (state, int(frame)) if state else (name, None)
+
+def pack_image(image):
+    base = Image.new("1", IMAGE_SIZE, 255)
+    base.paste(image, (0, 0))
+    return base.rotate(90, expand=True).convert("1").tobytes("raw")
+
+def xor_frames(first, second):
+    return (int.from_bytes(first, "big") ^ int.from_bytes(second, "big")).to_bytes(len(first), "big")
+
+def find_dirty_region(previous, buffer):
+    return find_changed_region(xor_frames(previous, buffer))
+
+def find_changed_region(changes):
+    if changes.count(0) == len(changes):
+        return None
+
+    rows = [y for y in range(len(changes) // ROW_BYTES) if any(changes[y * ROW_BYTES:(y + 1) * ROW_BYTES])]
+    columns = [x for x in range(ROW_BYTES) if any(changes[x::ROW_BYTES])]
+    return [columns[0], rows[0], columns[-1], rows[-1]]
+
+def find_transitions(frames):
+    transitions = {}
+    states = sorted(set(state for state, frame in frames if frame))
+    for state in states:
+        numbers = sorted(frame for frame_state, frame in frames if frame_state == state and frame)
+        for current, following in zip(numbers, numbers[1:] + numbers[:1]):
+            delta = xor_frames(frames[(state, current)], frames[(state, following)])
+            transitions[(state, current, following)] = [find_changed_region(delta), delta]
+    return transitions
+
+def is_sheet_stale():
+    try:
+        built_at = os.path.getmtime(SHEET_PATH)
+        with open(SHEET_PATH, "rb") as file:
+            check_header(file.read(HEADER.size), os.path.getsize(SHEET_PATH))
+    except Exception as e:
+        print(f"Can't use {SHEET_PATH} due to {e}")
+        return True
+    return any(os.path.getmtime(path) > built_at for path in list_assets())
+
+def check_header(sheet, size):
+    magic, version, frame_count, transition_count, frame_size = HEADER.unpack_from(sheet, 0)
+    if magic != SHEET_MAGIC or version != SHEET_VERSION:
+        raise Exception(f"{SHEET_PATH} isn't a version {SHEET_VERSION} sprite sheet")
+    if size != sheet_size(frame_count, transition_count, frame_size):
+        raise Exception(f"{SHEET_PATH} is truncated")
+    return [frame_count, transition_count, frame_size]
+
+def sheet_size(frame_count, transition_count, frame_size):
+    return entries_size(frame_count, transition_count) + (frame_count + transition_count) * frame_size
+
+def entries_size(frame_count, transition_count):
+    return HEADER.size + frame_count * FRAME_ENTRY.size + transition_count * TRANSITION_ENTRY.size
+
+def write_sheet(frames, transitions):
+    frame_size = len(next(iter(frames.values())))
+    offset = entries_size(len(frames), len(transitions))
+
+    header = HEADER.pack(SHEET_MAGIC, SHEET_VERSION, len(frames), len(transitions), frame_size)
+    frame_entries = []
+    for index, (state, frame) in enumerate(frames):
+        frame_entries.append(FRAME_ENTRY.pack(state.encode(), frame or NO_FRAME, offset + index * frame_size))
+
+    offset += len(frames) * frame_size
+    transition_entries = []
+    for index, ((state, current, following), (region, delta)) in enumerate(transitions.items()):
+        changed = 1 if region else 0
+        x_start, y_start, x_end, y_end = region or [0, 0, 0, 0]
+        transition_entries.append(TRANSITION_ENTRY.pack(state.encode(), current, following, changed, x_start, x_end, y_start, y_end, offset + index * frame_size))
+
+    temp_path = f"{SHEET_PATH}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(header)
+        file.write(b"".join(frame_entries))
+        file.write(b"".join(transition_entries))
+        file.write(b"".join(frames.values()))
+        file.write(b"".join(delta for _, delta in transitions.values()))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, SHEET_PATH)
+
+def read_sheet():
+    with open(SHEET_PATH, "rb") as file:
+        sheet = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    frame_count, transition_count, frame_size = check_header(sheet, len(sheet))
+
+    frames = {}
+    position = HEADER.size
+    for _ in range(frame_count):
+        state, frame, offset = FRAME_ENTRY.unpack_from(sheet, position)
+        frames[(state.rstrip(b"\0").decode(), frame or None)] = sheet[offset:offset + frame_size]
+        position += FRAME_ENTRY.size
+
+    transitions = {}
+    for _ in range(transition_count):
+        state, current, following, changed, x_start, x_end, y_start, y_end, offset = TRANSITION_ENTRY.unpack_from(sheet, position)
+        region = [x_start, y_start, x_end, y_end] if changed else None
+        transitions[(state.rstrip(b"\0").decode(), current, following)] = [region, sheet[offset:offset + frame_size]]
+        position += TRANSITION_ENTRY.size
+
+    return [frames, transitions]
@@ -0,0 +1,42 @@
+import threading
+from collections import deque
+
+WINDOW_SIZE = 1000
+PERCENTILES = [50, 95, 99]
+
+class RollingStats:
+    def __init__(self, name, size=WINDOW_SIZE):
+        self.name = name
+        self.values = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def add(self, value):
+        with self.lock:
+            self.values.append(value)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def count(self):
+        with self.lock:
+            return len(self.values)
+
+    def mean(self):
+        with self.lock:
+            values = list(self.values)
+        return sum(values) / len(values) if values else 0
+
+    def percentiles(self):
+        with self.lock:
+            values = sorted(self.values)
+        if not values:
+            return {}
+        return { p: values[min(len(values) - 1, len(values) * p // 100)] for p in PERCENTILES }
+
+    def describe(self):
+        percentiles = self.percentiles()
+        if not percentiles:
+            return f"{self.name}: no samples"
+        described = " ".join(f"p{p}={value * 1000:.2f}ms" for p, value in percentiles.items())
+        return f"{self.name}: {described} (n={len(self.values)})"
@@ -1,13 +1,23 @@
-from datetime import datetime, timedelta
+from time import monotonic
+
+def now():
+    return monotonic()
 
 def seconds_ago(seconds):
-    return datetime.now() - timedelta(seconds=seconds)
+    return monotonic() - seconds
 
 def seconds_from_now(seconds):
-    return datetime.now() + timedelta(seconds=seconds)
+    return monotonic() + seconds
 
 def is_past(time):
-    return time and time <= datetime.now()
+    return time is not None and time <= monotonic()
 
 def is_older_than(time, seconds):
-    return time and time <= seconds_ago(seconds)
+    return time is not None and time <= seconds_ago(seconds)
+
+def wait_until(event, *deadlines):
+    pending = [deadline for deadline in deadlines if deadline is not None]
+    if pending:
+        event.wait(max(0, min(pending) - monotonic()))
+    else:
+        event.wait()
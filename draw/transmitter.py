@@ -1,29 +1,51 @@
+import sys
 import json
 import threading
 import traceback
-from time import sleep
+from time import time, monotonic
 from spawn import spawn
 from watch_bt import watch_bt
 from btkeyboard import BtKeyboard
+from stats_helpers import RollingStats
+from frame_helpers import unpack_frame
 from spawn_stdin import spawn_stdin
 from line_helpers import parse_line
-from spawn_socket import spawn_socket
-from time_helpers import seconds_from_now, is_past
-from socket_helpers import send_to_socket, SOCKET_CAT, SOCKET_BUTTONS, SOCKET_TRANSMITTER
+from spawn_socket import spawn_socket, spawn_packets
+from list_helpers import difference
+from backoff_helpers import backoff_delay
+from time_helpers import seconds_from_now, is_past, wait_until
+from socket_helpers import send_to_socket, SOCKET_CAT, SOCKET_BUTTONS, SOCKET_RELAY, SOCKET_REPORTS, SOCKET_TRANSMITTER
 from last_address_helpers import read_last_address, write_last_address
+from history_helpers import read_history, record_attempt, rank_addresses, best_address
+
+PROBE_FLAG = "--probe"
 
 ZERO_DELAY = 0
 SHORT_DELAY = 3
 ABORT_DELAY = 120
-ATTEMPT_DELAY = 60
-TIMER_INTERVAL = 0.25
+LOCK_DELAY = 2 * BtKeyboard.CONNECT_TIMEOUT
+DISCOVERY_TIME = 10
+DISCOVERY_PERIOD = 60
+
+STALL_SAMPLES = 10
+STALL_SEND_TIME = 0.1
+STALL_SEND_AGE = 1
 
-btkeyboard = BtKeyboard()
+btkeyboard = None
 
 attempt_at = seconds_from_now(SHORT_DELAY)
-current_target = read_last_address()
+host_history = read_history()
+current_target = best_address(host_history) or read_last_address()
+tried_targets = []
 external_unlock_at = None
 internal_unlock_at = None
+link_check_at = None
+discovery_at = None
+discovery_until = None
+failed_attempts = 0
+
+queue_stats = RollingStats("Queueing")
+ipc_stats = RollingStats("IPC")
 
 watch_loop = None
 error_event = threading.Event()
@@ -58,36 +80,102 @@ def iterate_timer():
     if not is_connected():
         report_disconnect()
 
+    if is_past(link_check_at):
+        check_link()
+
     if should_attempt():
         local_target = current_target
         new_attempt_at(None)
-        new_internal_unlock_at(ABORT_DELAY)
+        new_internal_unlock_at(LOCK_DELAY)
+        btkeyboard.discover(None)
 
         print(f"Locking and trying {local_target}")
         report_attempt(local_target)
-        connected = btkeyboard.connect(local_target)
+        local_target, connected = connect_target(local_target)
 
         if local_target != current_target or external_unlock_at:
             print(f"Ignoring {local_target} changing its state to Connected={connected}")
             btkeyboard.disconnect()
         elif connected:
             print(f"Connected to {local_target}")
+            new_failed_attempts(0)
+            tried_targets.clear()
+            btkeyboard.clear_link_stats()
             report_connect(local_target)
             write_last_address(local_target)
         else:
             print(f"Couldn't connect to {local_target}")
+            new_failed_attempts(failed_attempts + 1)
             report_unsuccessful_attempt(current_target)
 
         new_internal_unlock_at(SHORT_DELAY)
 
     if should_schedule_attempt():
-        print("Planning a new attempt")
-        new_attempt_at(ATTEMPT_DELAY)
+        delay = backoff_delay(failed_attempts)
+        print(f"Planning a new attempt in {delay:.0f}s")
+        new_attempt_at(delay)
 
-    if attempt_at or internal_unlock_at or external_unlock_at:
-        sleep(TIMER_INTERVAL)
-    else:
-        attempt_event.wait()
+    update_discovery()
+
+    wait_until(attempt_event, attempt_at if can_attempt() else None, internal_unlock_at, external_unlock_at, link_check_at, discovery_at, discovery_until)
+
+def update_discovery():
+    if not should_discover():
+        new_discovery_at(None)
+        new_discovery_until(None)
+    elif discovery_at is None or is_past(discovery_at):
+        new_discovery_at(DISCOVERY_PERIOD)
+        new_discovery_until(DISCOVERY_TIME)
+    elif is_past(discovery_until):
+        new_discovery_until(None)
+
+    btkeyboard.discover(current_target if discovery_until else None)
+
+def check_link():
+    new_link_check_at(None)
+    if not is_connected():
+        return
+
+    if is_link_stalled():
+        print(f"Link to {current_target} stalls, reconnecting")
+        btkeyboard.clear_link_stats()
+        retry_target()
+    elif btkeyboard.sending_at:
+        new_link_check_at(max(0, STALL_SEND_AGE - btkeyboard.send_age))
+
+def on_send():
+    if not link_check_at:
+        new_link_check_at(STALL_SEND_AGE)
+
+def is_link_stalled():
+    if btkeyboard.send_age > STALL_SEND_AGE:
+        return True
+
+    if btkeyboard.link_stats.count() < STALL_SAMPLES:
+        return False
+
+    return btkeyboard.link_stats.percentiles()[50] > STALL_SEND_TIME
+
+def connect_target(local_target):
+    targets = [local_target]
+    if should_probe(local_target):
+        targets += difference(get_addresses(), targets)
+    if len(targets) > 1:
+        print(f"Probing {targets}")
+
+    started_at = monotonic()
+    connected_target, failed_targets = btkeyboard.connect_any(targets)
+    for target in failed_targets:
+        record_attempt(host_history, target, False, None)
+    if connected_target:
+        record_attempt(host_history, connected_target, True, monotonic() - started_at)
+
+    if not connected_target:
+        return [local_target, False]
+
+    if connected_target != local_target and should_probe(local_target):
+        new_target(connected_target)
+    return [connected_target, True]
 
 def process_line(line):
     print(f"Processing {line}")
@@ -105,9 +193,27 @@ def process_line(line):
         pause_timer()
     elif what == "Unpause":
         unpause_timer()
+    elif what == "Stats":
+        print_stats()
     else:
         print(f"Unknown {line}")
 
+def process_packet(packet):
+    received_at = time()
+    event_at, sent_at, report = unpack_frame(packet)
+    queue_stats.add(sent_at - event_at)
+    ipc_stats.add(received_at - sent_at)
+    btkeyboard.send(report, event_at)
+
+def print_stats():
+    print(f"Queue depth: {btkeyboard.queue_depth}")
+    print(f"Dropped reports: {btkeyboard.dropped_reports}")
+    for stats in [queue_stats, ipc_stats, *btkeyboard.stats, btkeyboard.link_stats]:
+        print(stats.describe())
+    print(f"Link errors: {btkeyboard.error_stats.mean() * 100:.0f}%")
+    print(f"Link send in flight: {btkeyboard.send_age * 1000:.0f}ms")
+    print(f"Link RSSI: {btkeyboard.rssi}")
+
 def pause_timer():
     new_external_unlock_at(ABORT_DELAY)
 
@@ -129,14 +235,15 @@ def next_target():
         report_failure("Look around first!")
         return
 
-    if current_target in addresses:
-        new_index = addresses.index(current_target) + 1
-        if new_index >= len(addresses):
-            new_index = 0
-    else:
-        new_index = 0
+    if current_target:
+        tried_targets.append(current_target)
+
+    untried_addresses = difference(addresses, tried_targets)
+    if not untried_addresses:
+        tried_targets.clear()
+        untried_addresses = difference(addresses, [current_target]) or addresses
 
-    new_target(addresses[new_index])
+    new_target(untried_addresses[0])
     new_attempt_at(ZERO_DELAY)
 
 def test_target():
@@ -166,8 +273,26 @@ def iterate_bt_change(connected, address):
         print(f"{address} disconnected")
         new_attempt_at(ZERO_DELAY)
 
+def on_bt_seen(address):
+    try:
+        iterate_bt_seen(address)
+    except Exception as e:
+        print(f"An unexpected error occurred in the bt seen handler: {e}")
+        traceback.print_exc()
+        error_event.set()
+
+def iterate_bt_seen(address):
+    if address != current_target or internal_unlock_at or not can_attempt():
+        return
+
+    if attempt_at and not is_past(attempt_at):
+        print(f"{address} is around")
+        new_attempt_at(ZERO_DELAY)
+
 def new_target(value):
     global current_target
+    if value != current_target:
+        new_failed_attempts(0)
     current_target = value
     attempt_event.set()
 
@@ -179,6 +304,32 @@ def new_attempt_at(value):
         attempt_at = seconds_from_now(value)
     attempt_event.set()
 
+def new_failed_attempts(value):
+    global failed_attempts
+    failed_attempts = value
+
+def new_link_check_at(value):
+    global link_check_at
+    if value is None:
+        link_check_at = None
+    else:
+        link_check_at = seconds_from_now(value)
+    attempt_event.set()
+
+def new_discovery_at(value):
+    global discovery_at
+    if value is None:
+        discovery_at = None
+    else:
+        discovery_at = seconds_from_now(value)
+
+def new_discovery_until(value):
+    global discovery_until
+    if value is None:
+        discovery_until = None
+    else:
+        discovery_until = seconds_from_now(value)
+
 def new_internal_unlock_at(value):
     global internal_unlock_at
     if value is None:
@@ -201,6 +352,12 @@ def can_attempt():
 def should_attempt():
     return can_attempt() and is_past(attempt_at)
 
+def should_probe(local_target):
+    return PROBE_FLAG in sys.argv and local_target == current_target and not external_unlock_at
+
+def should_discover():
+    return can_attempt() and attempt_at and not is_past(attempt_at) and not internal_unlock_at
+
 def should_schedule_attempt():
     return can_attempt() and not attempt_at
 
@@ -208,7 +365,7 @@ def is_connected():
     return btkeyboard.is_connected and btkeyboard.target == current_target
 
 def get_addresses():
-    return [device["address"] for device in btkeyboard.devices]
+    return rank_addresses(host_history, [device["address"] for device in btkeyboard.devices])
 
 def get_alias(address):
     for device in btkeyboard.devices:
@@ -236,10 +393,19 @@ def report_unsuccessful_attempt(address):
     send_to_socket(SOCKET_CAT, f"Flush: Can't reach {get_alias(address)}")
     send_to_socket(SOCKET_BUTTONS, "Blink Short: Red")
 
-watch_loop = watch_bt(on_bt_change)
-error_thread = spawn(manage_error)
-timer_thread = spawn(manage_timer)
-stdin_thread = spawn_stdin(process_line, error_event)
-socket_thread = spawn_socket(SOCKET_TRANSMITTER, process_line, error_event)
-
-watch_loop.run()
+def forward_leds(leds):
+    send_to_socket(SOCKET_RELAY, f"Leds: {leds}")
+
+def start_transmitter(on_leds=forward_leds):
+    global btkeyboard, watch_loop
+    btkeyboard = BtKeyboard(on_leds=on_leds, on_send=on_send)
+    watch_loop = watch_bt(on_bt_change, on_bt_seen)
+    spawn(manage_error)
+    spawn(manage_timer)
+    spawn_stdin(process_line, error_event)
+    spawn_socket(SOCKET_TRANSMITTER, process_line, error_event)
+    spawn_packets(SOCKET_REPORTS, process_packet, error_event)
+    return watch_loop
+
+if __name__ == "__main__":
+    start_transmitter().run()
@@ -1,5 +1,6 @@
 import re
 import dbus
+import threading
 import traceback
 from spawn import spawn
 from gi.repository import GLib
@@ -7,19 +8,25 @@ from dbus.mainloop.glib import DBusGMainLoop
 
 DEVICE_INTERFACE = 'org.bluez.Device1'
 DBUS_PROP_IFACE = 'org.freedesktop.DBus.Properties'
+DBUS_OM_IFACE = 'org.freedesktop.DBus.ObjectManager'
 
 sole_callback = None
+seen_callback = None
 
-def watch_bt(callback):
-    global sole_callback
+known_devices = None
+devices_lock = threading.Lock()
+
+def watch_bt(callback, on_seen=None, bus=None):
+    global sole_callback, seen_callback
 
     if sole_callback:
         raise Exception("already watching!")
 
     sole_callback = callback
+    seen_callback = on_seen
 
     DBusGMainLoop(set_as_default=True)
-    bus = dbus.SystemBus()
+    bus = bus or dbus.SystemBus()
     bus.add_signal_receiver(
         on_change,
         dbus_interface=DBUS_PROP_IFACE,
@@ -27,15 +34,80 @@ def watch_bt(callback):
         arg0=DEVICE_INTERFACE,
         path_keyword='path'
     )
+    bus.add_signal_receiver(
+        on_added,
+        dbus_interface=DBUS_OM_IFACE,
+        signal_name='InterfacesAdded'
+    )
+    bus.add_signal_receiver(
+        on_removed,
+        dbus_interface=DBUS_OM_IFACE,
+        signal_name='InterfacesRemoved'
+    )
+    load_devices(bus)
 
     mainloop = GLib.MainLoop()
     return mainloop
 
+def load_devices(bus):
+    global known_devices
+    managed_objects = get_managed_objects(bus)
+    with devices_lock:
+        known_devices = {}
+        for path, interfaces in managed_objects.items():
+            if DEVICE_INTERFACE in interfaces:
+                known_devices[path] = dict(interfaces[DEVICE_INTERFACE])
+
+def get_managed_objects(bus):
+    proxy_object = bus.get_object("org.bluez", "/")
+    return dbus.Interface(proxy_object, DBUS_OM_IFACE).GetManagedObjects()
+
+def read_devices():
+    with devices_lock:
+        if known_devices is None:
+            return None
+        return parse_devices(known_devices.values())
+
+def parse_devices(properties):
+    devices = []
+    for device in properties:
+        alias = device.get("Alias")
+        address = device.get("Address")
+        paired = device.get("Paired", False)
+        connected = device.get("Connected", False)
+        if address and alias and (paired or connected):
+            devices.append({ "address": address, "alias": alias, "paired": paired, "connected": connected, "rssi": device.get("RSSI") })
+    return devices
+
 def on_change(interface, changed, invalidated, path):
+    with devices_lock:
+        if known_devices is not None and path in known_devices:
+            known_devices[path].update(changed)
+            for name in invalidated:
+                known_devices[path].pop(name, None)
+
     if 'Connected' in changed:
         address = parse_address(path)
         connected = changed['Connected']
         sole_callback(connected, address)
 
+    if 'RSSI' in changed and seen_callback:
+        seen_callback(parse_address(path))
+
+def on_added(path, interfaces):
+    if DEVICE_INTERFACE in interfaces:
+        with devices_lock:
+            if known_devices is not None:
+                known_devices[path] = dict(interfaces[DEVICE_INTERFACE])
+
+        if seen_callback:
+            seen_callback(parse_address(path))
+
+def on_removed(path, interfaces):
+    if DEVICE_INTERFACE in interfaces:
+        with devices_lock:
+            if known_devices is not None:
+                known_devices.pop(path, None)
+
 def parse_address(path):
     return re.search(r"([A-F0-9]{2}[_:]){5}[A-F0-9]{2}", path).group().replace("_", ":")